@@ -1,14 +1,24 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import yfinance as yf
 import plotly.graph_objects as go
 import plotly.express as px
+from plotly.subplots import make_subplots
 import os
 import time
 import json
-import re
+import hashlib
+import copy
+import sqlite3
+import threading
+import ast
+import inspect
+import warnings
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 import gspread
+from gspread.utils import rowcol_to_a1
 from oauth2client.service_account import ServiceAccountCredentials
 
 # FinanceDataReader 선택적 임포트 (없어도 앱 실행 가능)
@@ -689,6 +699,162 @@ st.markdown("""
 SPREADSHEET_NAME = "Integrated_Stock_DB" 
 SCOPE = ['https://spreadsheets.google.com/feeds',
          'https://www.googleapis.com/auth/drive']
+DRIVE_FILES_URL = "https://www.googleapis.com/drive/v3/files/"
+STOCK_COLUMNS = ["Symbol", "Name", "InterestDate", "Note", "MarketCap", "Installments", "Category", "BuyTransactions", "SellTransactions", "ChangeRate"]
+
+# 로컬 저장소 설정 (Google Sheets는 백그라운드로 동기화되는 복제본)
+DATA_DIR = "data"
+STOCKS_DB_PATH = os.path.join(DATA_DIR, "stocks.db")
+SHEET_SYNC_INTERVAL = 60  # 시트 변경 확인 주기 (초)
+OHLCV_DB_PATH = os.path.join(DATA_DIR, "ohlcv.db")
+OHLCV_COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+OHLCV_REFRESH_INTERVAL = 7200  # 마지막 갱신 후 이 시간이 지나면 최근 구간만 다시 받음 (초)
+OHLCV_OVERLAP_DAYS = 10  # 꼬리 갱신 시 겹쳐서 받는 기간 (수정주가 변경 감지용)
+
+# 주가 일괄 조회 설정
+PRICE_FETCH_WORKERS = 8  # 일괄 조회 스레드 수
+
+# 외부 API 제공자별 요청 제한 (초당 요청 수, 버스트, 동시 요청 수)
+# Streamlit secrets의 [provider_limits.<제공자>] 항목으로 덮어쓸 수 있음
+PROVIDER_LIMITS = {
+    "fdr": {"rate": 5.0, "burst": 10, "concurrency": 4},
+    "yfinance": {"rate": 2.0, "burst": 5, "concurrency": 4},
+    "gsheets": {"rate": 1.0, "burst": 5, "concurrency": 2},
+}
+CIRCUIT_BREAKER_THRESHOLD = 3  # 연속 429(요청 과다) 횟수가 이 값에 도달하면 호출 차단
+CIRCUIT_BREAKER_COOLDOWN = 300  # 차단 유지 시간 (초) - 그동안은 저장된 데이터 사용
+
+# 백그라운드 주가 미리 받기 (장 마감 후 전체 종목 갱신)
+MARKET_CLOSE_TIMES = {
+    "KRX": ("Asia/Seoul", 15, 30),  # 한국 종목 (.KS/.KQ, 6자리 코드)
+    "US": ("America/New_York", 16, 0),  # 그 외 종목
+}
+PREFETCH_SETTLE_MINUTES = 30  # 장 마감 후 종가가 확정될 때까지 기다리는 시간 (분)
+PREFETCH_POLL_INTERVAL = 300  # 스케줄러 확인 주기 (초)
+
+# 실시간 시세 캐시 유지 시간 (초) - 이 시간 동안 모든 세션이 같은 일괄 조회 결과를 공유
+INTRADAY_QUOTE_TTL = 60
+
+# 시장 전체 스크리너 (KRX 전 종목 일봉 저장소)
+UNIVERSE_DIR = os.path.join(DATA_DIR, "universe")
+UNIVERSE_MARKETS = ["KOSPI", "KOSDAQ"]  # 스캔 대상 시장
+UNIVERSE_HISTORY_DAYS = 800  # 보관 기간 (80주 이동평균 + 여유)
+UNIVERSE_SAVE_EVERY = 200  # 이 종목 수만큼 받을 때마다 중간 저장
+
+# 주가 이력 일괄 받기 (백그라운드 작업, 중단 시 이어받기)
+BACKFILL_CHECKPOINT_PATH = os.path.join(DATA_DIR, "backfill_checkpoint.json")
+BACKFILL_CHUNK_SIZE = 25  # 한 번에 병렬로 받을 종목 수 (청크마다 진행 상황 저장)
+STOCKS_CSV_PATH = "stocks.csv"
+
+# 차트 데이터 축소 (기간과 관계없이 브라우저로 보내는 봉 수를 일정하게 유지)
+CHART_TARGET_WIDTH_PX = 1200  # 차트 기준 폭 (픽셀)
+CHART_MIN_PX_PER_BAR = 2  # 봉 하나에 필요한 최소 폭 (픽셀) - 이보다 좁아지면 더 긴 봉으로 묶음
+CHART_BAR_RULES = [("일봉", None), ("주봉", "W-FRI"), ("월봉", "MS"), ("분기봉", "QS")]
+
+# 종목 비교 차트
+COMPARISON_MAX_SYMBOLS = 20  # 한 번에 비교할 최대 종목 수
+COMPARISON_SUBPLOT_COLUMNS = 3  # 종목별 차트 보기의 열 수
+
+# 주가 조회 실패 기록 유지 시간 (초) - 이 기간 동안은 해당 종목을 다시 요청하지 않음
+NEGATIVE_CACHE_TTL = {
+    "not_found": 24 * 3600,  # 상장폐지/오타 등 데이터 없음
+    "rate_limited": CIRCUIT_BREAKER_COOLDOWN,  # 요청 과다 또는 차단 중
+    "parse_error": 6 * 3600,  # 응답 형식 오류
+    "fetch_error": 30 * 60,  # 네트워크 등 기타 오류
+}
+
+# ==========================================
+# 외부 API 요청 제한 (제공자별 토큰 버킷 + 서킷 브레이커)
+# ==========================================
+
+# 토큰 버킷 속도 제한기
+class TokenBucket:
+    """초당 rate개씩 토큰이 채워지는 버킷 (최대 burst개). acquire()는 토큰을 얻을 때까지 대기합니다."""
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class CircuitOpenError(Exception):
+    """서킷 브레이커가 열려 제공자 호출이 차단된 상태"""
+
+# 요청 과다(429) 오류인지 확인
+def _is_rate_limit_error(error):
+    status = getattr(getattr(error, 'response', None), 'status_code', None)
+    if status == 429:
+        return True
+    error_msg = str(error).lower()
+    return "too many requests" in error_msg or "rate limit" in error_msg or "429" in error_msg
+
+class ProviderGuard:
+    """
+    제공자 하나에 대한 요청 제한기.
+    동시 요청 수(세마포어)와 초당 요청 수(토큰 버킷)를 제한하고,
+    연속 429가 CIRCUIT_BREAKER_THRESHOLD번 발생하면 CIRCUIT_BREAKER_COOLDOWN 동안 호출을 차단합니다.
+    """
+    def __init__(self, name, rate, burst, concurrency):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.semaphore = threading.BoundedSemaphore(concurrency)
+        self.lock = threading.Lock()
+        self.consecutive_rate_limits = 0
+        self.open_until = 0.0
+    
+    def is_open(self):
+        return time.monotonic() < self.open_until
+    
+    def call(self, func, *args, **kwargs):
+        if self.is_open():
+            raise CircuitOpenError(f"{self.name} 요청이 일시적으로 차단되었습니다.")
+        with self.semaphore:
+            self.bucket.acquire()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                if _is_rate_limit_error(e):
+                    self._record_rate_limited()
+                raise
+        with self.lock:
+            self.consecutive_rate_limits = 0
+        return result
+    
+    def _record_rate_limited(self):
+        with self.lock:
+            self.consecutive_rate_limits += 1
+            if self.consecutive_rate_limits >= CIRCUIT_BREAKER_THRESHOLD:
+                self.open_until = time.monotonic() + CIRCUIT_BREAKER_COOLDOWN
+                self.consecutive_rate_limits = 0
+
+# 프로세스 전체에서 공유하는 제공자별 요청 제한기 (모든 세션/스레드 공용)
+@st.cache_resource
+def get_provider_guards():
+    try:
+        overrides = {name: dict(values) for name, values in st.secrets.get("provider_limits", {}).items()}
+    except Exception:
+        overrides = {}
+    guards = {}
+    for name, limits in PROVIDER_LIMITS.items():
+        config = {**limits, **overrides.get(name, {})}
+        guards[name] = ProviderGuard(name, float(config["rate"]), int(config["burst"]), int(config["concurrency"]))
+    return guards
+
+# 제공자 호출 (속도 제한 + 서킷 브레이커 적용)
+def call_provider(provider, func, *args, **kwargs):
+    return get_provider_guards()[provider].call(func, *args, **kwargs)
 
 # Google Sheets 클라이언트 가져오기 (캐싱)
 @st.cache_resource
@@ -716,9 +882,10 @@ def get_google_sheets_client():
                 "secrets.json 파일이 올바른 형식인지 확인해주세요.")
         st.stop()
 
-# Google Sheets 초기화
+# Google Sheets 초기화 (스프레드시트/워크시트 핸들을 프로세스당 한 번만 열고 재사용)
+@st.cache_resource
 def init_google_sheet():
-    """Google Sheets 스프레드시트와 워크시트를 초기화합니다."""
+    """Google Sheets 스프레드시트와 워크시트를 초기화하고 (spreadsheet, worksheet) 핸들을 반환합니다."""
     try:
         client = get_google_sheets_client()
         
@@ -762,47 +929,494 @@ def init_google_sheet():
         st.error(f"❌ Google Sheets 초기화 실패: {str(e)}")
         st.stop()
 
-# Google Sheets에서 데이터 읽기 (통합 시트)
-@st.cache_data(ttl=60)  # 1분 캐싱 (데이터 변경 시 빠른 반영)
-def load_stocks():
-    """Google Sheets에서 종목 데이터를 로드합니다 (통합 시트)."""
-    try:
-        client = get_google_sheets_client()
-        spreadsheet = client.open(SPREADSHEET_NAME)
-        worksheet = spreadsheet.worksheet("Stocks")
-        
-        # 모든 데이터 가져오기
-        records = worksheet.get_all_records()
-        
-        if not records:
-            # 빈 DataFrame 반환 (헤더만 있는 경우)
-            columns = ["Symbol", "Name", "InterestDate", "Note", "MarketCap", "Installments", "Category", "BuyTransactions", "SellTransactions", "ChangeRate"]
-            return pd.DataFrame(columns=columns)
+# 캐시된 핸들이 더 이상 유효하지 않은 오류인지 확인 (인증 만료, 워크시트 삭제/이름 변경 등)
+def _is_stale_handle_error(error):
+    if isinstance(error, (gspread.WorksheetNotFound, gspread.SpreadsheetNotFound)):
+        return True
+    if isinstance(error, gspread.exceptions.APIError):
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+        if status in (401, 404):
+            return True
+        message = str(error)
+        if status == 400 and ("Unable to parse range" in message or "No grid with id" in message):
+            return True
+    return False
+
+class _GuardedSheetHandle:
+    """
+    gspread 객체(Spreadsheet / Worksheet / Client)를 감싸서 API 메서드 호출 하나마다 gsheets 제한기를 거치게 합니다.
+    resolve()는 감쌀 실제 객체를 반환합니다 (다시 열린 핸들을 따라가도록 호출할 때마다 확인).
+    reopen이 주어지면 핸들 무효화 오류 시 reopen(오류)로 핸들을 다시 연 뒤, 실패한 그 호출만 한 번 재시도합니다.
+    """
+    _NESTED_TYPES = (gspread.Spreadsheet, gspread.Worksheet, gspread.Client)
+    
+    def __init__(self, resolve, reopen=None):
+        self._resolve = resolve
+        self._reopen = reopen
+    
+    def __getattr__(self, name):
+        attr = getattr(self._resolve(), name)
+        # worksheet.spreadsheet, spreadsheet.client 등 하위 객체도 같은 방식으로 감쌈
+        if isinstance(attr, self._NESTED_TYPES):
+            return _GuardedSheetHandle(lambda: getattr(self._resolve(), name), self._reopen)
+        if not callable(attr):
+            return attr
         
-        # DataFrame으로 변환
-        df = pd.DataFrame(records)
+        def call(*args, **kwargs):
+            try:
+                return call_provider("gsheets", getattr(self._resolve(), name), *args, **kwargs)
+            except Exception as e:
+                if self._reopen is None or not _is_stale_handle_error(e):
+                    raise
+                self._reopen(e)
+                return call_provider("gsheets", getattr(self._resolve(), name), *args, **kwargs)
+        return call
+
+# 무효화된 Stocks 워크시트 핸들 다시 열기 (401이면 인증 클라이언트도 새로 만듦)
+def _reopen_stocks_worksheet(error):
+    status = getattr(getattr(error, 'response', None), 'status_code', None)
+    if status == 401:
+        get_google_sheets_client.clear()
+    init_google_sheet.clear()
+    init_google_sheet()
+
+# 캐시된 Stocks 워크시트 핸들로 작업 실행
+def with_stocks_worksheet(action):
+    """
+    캐시된 (spreadsheet, worksheet) 핸들로 action(spreadsheet, worksheet)을 실행합니다.
+    action 안의 API 호출은 하나하나 gsheets 제한기를 거치며, 차단 중이면 CircuitOpenError가 발생합니다.
+    인증 만료나 WorksheetNotFound 등으로 핸들이 무효화되면 다시 열어서 실패한 호출만 재시도합니다
+    (이미 반영된 앞선 호출은 다시 보내지 않음).
+    """
+    init_google_sheet()
+    spreadsheet = _GuardedSheetHandle(lambda: init_google_sheet()[0], _reopen_stocks_worksheet)
+    worksheet = _GuardedSheetHandle(lambda: init_google_sheet()[1], _reopen_stocks_worksheet)
+    return action(spreadsheet, worksheet)
+
+# ==========================================
+# 로컬 저장소 (SQLite) - 시트 데이터의 기본 읽기 경로
+# ==========================================
+
+# 로컬 SQLite 연결 (호출마다 새 연결: 스레드 간 공유하지 않음)
+def _connect_local_db(path):
+    os.makedirs(DATA_DIR, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+def _init_stocks_store(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sheet_snapshot (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            revision INTEGER NOT NULL,
+            remote_version TEXT,
+            synced_at REAL NOT NULL,
+            records TEXT NOT NULL
+        )
+    """)
+
+# 로컬에 저장된 시트 스냅샷 읽기
+def _read_local_stocks(revision=None):
+    """
+    로컬 저장소의 시트 스냅샷을 반환합니다. 저장된 것이 없으면 None.
+    revision이 주어지면 저장된 스냅샷이 그 revision일 때만 반환합니다 (그 사이 다른 쓰기가 있었으면 None).
+    """
+    conn = _connect_local_db(STOCKS_DB_PATH)
+    try:
+        _init_stocks_store(conn)
+        if revision is None:
+            row = conn.execute(
+                "SELECT revision, remote_version, synced_at, records FROM sheet_snapshot WHERE id = 1"
+            ).fetchone()
+        else:
+            row = conn.execute(
+                "SELECT revision, remote_version, synced_at, records FROM sheet_snapshot WHERE id = 1 AND revision = ?",
+                (revision,)
+            ).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    return {
+        'revision': row[0],
+        'remote_version': row[1],
+        'synced_at': row[2],
+        'records': json.loads(row[3])
+    }
+
+# 로컬 저장소에 시트 스냅샷 쓰기
+def _write_local_stocks(records, remote_version, expected_revision=None):
+    """
+    시트 레코드를 로컬 저장소에 기록하고 revision을 1 증가시킵니다.
+    expected_revision이 주어지면 그 사이에 다른 쓰기가 없었을 때만 기록합니다 (백그라운드 동기화용).
+    기록하지 않았으면 None을 반환합니다.
+    """
+    conn = _connect_local_db(STOCKS_DB_PATH)
+    try:
+        _init_stocks_store(conn)
+        with conn:
+            row = conn.execute("SELECT revision FROM sheet_snapshot WHERE id = 1").fetchone()
+            current_revision = row[0] if row else 0
+            if expected_revision is not None and current_revision != expected_revision:
+                return None
+            new_revision = current_revision + 1
+            conn.execute(
+                "INSERT OR REPLACE INTO sheet_snapshot (id, revision, remote_version, synced_at, records) "
+                "VALUES (1, ?, ?, ?, ?)",
+                (new_revision, remote_version, time.time(), json.dumps(records, ensure_ascii=False, default=str))
+            )
+    finally:
+        conn.close()
+    return {
+        'revision': new_revision,
+        'remote_version': remote_version,
+        'synced_at': time.time(),
+        'records': records
+    }
+
+# 저장 직후 로컬 복제본 갱신 (write-through)
+def _write_through_local_stocks(df):
+    """
+    시트에 저장한 데이터를 로컬 저장소에도 반영합니다.
+    시트의 수정 시각은 알 수 없으므로 비워두어 다음 동기화 때 시트 원본으로 한 번 더 맞춥니다.
+    """
+    records = df.fillna("").to_dict('records')
+    _write_local_stocks(records, None)
+
+# 시트 버전(Drive 수정 시각) 조회 - 시트 전체를 읽지 않고 메타데이터만 요청
+def _get_sheet_version(spreadsheet):
+    getter = getattr(spreadsheet, 'get_lastUpdateTime', None)  # gspread 6.x
+    if getter is not None:
+        return getter()
+    response = spreadsheet.client.request(
+        "get",
+        DRIVE_FILES_URL + spreadsheet.id,
+        params={"fields": "modifiedTime", "supportsAllDrives": True}
+    )
+    return response.json().get("modifiedTime")
+
+# 시트 전체를 받아 로컬 저장소에 기록
+def _pull_stocks_from_sheet(spreadsheet, worksheet, expected_revision=None):
+    remote_version = _get_sheet_version(spreadsheet)
+    records = worksheet.get_all_records()
+    return _write_local_stocks(records, remote_version, expected_revision)
+
+# 시트가 변경되었을 때만 로컬 저장소 갱신
+def _sync_stocks_from_sheet(spreadsheet, worksheet):
+    """시트의 수정 시각이 로컬에 기록된 버전과 다를 때만 전체 데이터를 받아옵니다."""
+    local = _read_local_stocks()
+    if local is not None and local['remote_version'] is not None:
+        if _get_sheet_version(spreadsheet) == local['remote_version']:
+            return False
+    expected_revision = local['revision'] if local is not None else 0
+    return _pull_stocks_from_sheet(spreadsheet, worksheet, expected_revision) is not None
+
+# 백그라운드 시트 동기화 스레드 (프로세스당 한 번만 시작)
+@st.cache_resource
+def start_sheet_sync(_client):
+    """SHEET_SYNC_INTERVAL마다 시트 버전을 확인하여 로컬 저장소를 갱신하는 스레드를 시작합니다."""
+    def worker():
+        # 스레드 전용 핸들 (한 번 열어두고 오류가 날 때만 다시 열기)
+        spreadsheet = None
+        worksheet = None
+        while True:
+            time.sleep(SHEET_SYNC_INTERVAL)
+            try:
+                if worksheet is None:
+                    spreadsheet = _client.open(SPREADSHEET_NAME)
+                    worksheet = spreadsheet.worksheet("Stocks")
+                # API 호출 하나마다 제한기를 거침 (오류 시 아래에서 핸들을 다시 엶)
+                _sync_stocks_from_sheet(_GuardedSheetHandle(lambda: spreadsheet), _GuardedSheetHandle(lambda: worksheet))
+            except CircuitOpenError:
+                # 요청 과다로 차단 중이면 핸들은 유지하고 다음 주기에 재시도
+                pass
+            except Exception:
+                # 네트워크/인증 오류 시 다음 주기에 스프레드시트를 다시 열어 재시도
+                spreadsheet = None
+                worksheet = None
+
+    thread = threading.Thread(target=worker, name="sheet-sync", daemon=True)
+    thread.start()
+    return thread
+
+# 로컬 저장소의 현재 revision만 조회 (레코드 JSON은 읽지 않음)
+def _read_local_revision():
+    conn = _connect_local_db(STOCKS_DB_PATH)
+    try:
+        _init_stocks_store(conn)
+        row = conn.execute("SELECT revision FROM sheet_snapshot WHERE id = 1").fetchone()
+    finally:
+        conn.close()
+    return row[0] if row else None
+
+# ==========================================
+# 종목 스냅샷 (revision 당 한 번 로드하여 모든 화면에서 공유)
+# ==========================================
+
+# BuyTransactions/SellTransactions 값 파싱 (JSON 문자열 또는 리스트)
+def parse_transactions(raw):
+    """거래 내역 셀 값을 리스트로 변환합니다. 비어있거나 잘못된 값이면 빈 리스트."""
+    if isinstance(raw, list):
+        return raw
+    try:
+        if raw is None or pd.isna(raw):
+            return []
+    except (TypeError, ValueError):
+        pass
+    raw_str = str(raw).strip()
+    if not raw_str or raw_str == '[]':
+        return []
+    try:
+        parsed = json.loads(raw_str)
+    except (json.JSONDecodeError, ValueError, TypeError):
+        return []
+    return parsed if isinstance(parsed, list) else []
+
+# 거래 내역의 수량 합계 (수량이 없거나 잘못된 항목은 0)
+def _transactions_quantity(transactions):
+    total = 0
+    for tx in transactions:
+        try:
+            total += int(float(tx.get('quantity', 0) or 0))
+        except (AttributeError, TypeError, ValueError):
+            pass
+    return total
+
+# 거래 내역의 금액 합계 (가격 × 수량, 값이 없거나 잘못된 항목은 0)
+def _transactions_cost(transactions):
+    total = 0.0
+    for tx in transactions:
+        try:
+            total += float(tx.get('price', 0) or 0) * float(tx.get('quantity', 0) or 0)
+        except (AttributeError, TypeError, ValueError):
+            pass
+    return total
+
+class StockSnapshot:
+    """
+    특정 revision의 통합 시트 데이터 스냅샷.
+    - sheet_df: 시트 원본 값 (분할 매수 플래너용)
+    - stocks_df: 빈 문자열을 pd.NA로 바꾼 값 (주식 추적기용)
+    - buy_lists / sell_lists: 행 순서대로 미리 파싱한 거래 내역 (읽기 전용, 수정 시 복사해서 사용)
+    - derived: 행 순서대로 미리 계산한 파생 컬럼 (buy_txs, sell_txs, has_buy, has_interest_date,
+      installments, has_installments, buy_qty, buy_cost, holding_qty, strategy, label) - 카테고리/전략 필터는 이 컬럼의 bool 마스크로 처리
+    - symbol_index / labels: Symbol -> 행 위치, Symbol -> "Name (Symbol)" 표시 문자열 (선택 상자는 Symbol을 값으로 사용)
+    여러 세션이 같은 객체를 공유하므로 DataFrame을 직접 수정하지 말고 copy()해서 사용합니다.
+    """
+    def __init__(self, revision, records):
+        self.revision = revision
+        if records:
+            self.sheet_df = pd.DataFrame(records)
+        else:
+            self.sheet_df = pd.DataFrame(columns=STOCK_COLUMNS)
+        self.stocks_df = self.sheet_df.replace("", pd.NA)
+        self.buy_lists = [parse_transactions(v) for v in self.sheet_df.get('BuyTransactions', pd.Series(dtype=object))]
+        self.sell_lists = [parse_transactions(v) for v in self.sheet_df.get('SellTransactions', pd.Series(dtype=object))]
+        if len(self.buy_lists) != len(self.sheet_df):
+            self.buy_lists = [[] for _ in range(len(self.sheet_df))]
+        if len(self.sell_lists) != len(self.sheet_df):
+            self.sell_lists = [[] for _ in range(len(self.sheet_df))]
+        self.derived = self._build_derived()
         
-        # 빈 값 처리 (Google Sheets는 빈 셀을 빈 문자열로 반환)
-        df = df.replace("", pd.NA)
+        # Symbol 색인 (중복 Symbol은 첫 행 사용, 빈 Symbol은 제외)
+        self.symbol_index = {}
+        self.labels = {}
+        for pos, (symbol, label) in enumerate(zip(self.stocks_df.get('Symbol', pd.Series(dtype=object)), self.derived['label'])):
+            if pd.notna(symbol) and symbol not in self.symbol_index:
+                self.symbol_index[symbol] = pos
+                self.labels[symbol] = label
+    
+    def label_of(self, symbol):
+        """선택 상자 format_func용 표시 문자열"""
+        return self.labels.get(symbol, str(symbol))
+    
+    def sorted_symbols(self, mask=None):
+        """mask(행 bool Series)에 해당하는 Symbol을 표시 문자열 가나다순으로 반환합니다."""
+        symbols = self.stocks_df['Symbol'] if mask is None else self.stocks_df.loc[mask, 'Symbol']
+        return sorted(
+            (symbol for symbol in dict.fromkeys(symbols.dropna()) if symbol in self.symbol_index),
+            key=self.labels.get
+        )
+    
+    def _build_derived(self):
+        index = self.sheet_df.index
         
-        # BuyTransactions, SellTransactions가 문자열이면 JSON 파싱 (나중에 사용 시)
-        # 여기서는 그대로 유지 (필요시 파싱)
+        def text_column(name):
+            if name not in self.sheet_df.columns:
+                return pd.Series("", index=index)
+            return self.sheet_df[name].fillna("").astype(str).str.strip()
         
-        return df
+        derived = pd.DataFrame(index=index)
+        derived['buy_txs'] = pd.Series(self.buy_lists, index=index, dtype=object)
+        derived['sell_txs'] = pd.Series(self.sell_lists, index=index, dtype=object)
+        derived['has_buy'] = derived['buy_txs'].map(len).astype(int) > 0
+        derived['has_interest_date'] = text_column('InterestDate') != ""
+        derived['installments'] = pd.to_numeric(text_column('Installments'), errors='coerce')
+        derived['has_installments'] = derived['installments'].fillna(0) > 0
+        # 보유 수량 = 매수 수량 합계 - 매도 수량 합계 (0 미만은 0), 매수 금액 합계 (평균 매수가 계산용)
+        derived['buy_qty'] = derived['buy_txs'].map(_transactions_quantity).astype(int)
+        derived['buy_cost'] = derived['buy_txs'].map(_transactions_cost).astype(float)
+        sold = derived['sell_txs'].map(_transactions_quantity)
+        derived['holding_qty'] = (derived['buy_qty'] - sold).clip(lower=0).astype(int)
+        derived['strategy'] = text_column('Category')
+        derived['label'] = text_column('Name') + " (" + text_column('Symbol') + ")"
+        return derived
+
+# 스냅샷을 읽는 사이에 저장소 revision이 바뀜
+class StaleRevisionError(LookupError):
+    pass
+
+# revision별 스냅샷 생성 (같은 revision이면 모든 세션/rerun이 재사용)
+@st.cache_resource(max_entries=2)
+def _load_stock_snapshot(revision):
+    """
+    저장소의 스냅샷이 정확히 이 revision일 때만 만듭니다. 그 사이에 새 쓰기가 있었으면 StaleRevisionError
+    (예외는 캐시되지 않으므로 다른 revision의 데이터가 이 revision 이름으로 캐시되지 않음).
+    """
+    if revision == 0 and _read_local_revision() is None:
+        return StockSnapshot(0, [])
+    local = _read_local_stocks(revision)
+    if local is None:
+        raise StaleRevisionError(f"revision {revision} 스냅샷을 더 이상 읽을 수 없습니다.")
+    return StockSnapshot(local['revision'], local['records'])
+
+# 현재 종목 스냅샷 가져오기
+def get_stock_snapshot():
+    """로컬 저장소의 현재 revision에 해당하는 종목 스냅샷을 반환합니다 (최초 실행 시에만 시트에서 직접 받음)."""
+    try:
+        client = get_google_sheets_client()
+        start_sheet_sync(client)
+        revision = _read_local_revision()
+        if revision is None:
+            revision = with_stocks_worksheet(_pull_stocks_from_sheet)['revision']
+        # revision 확인과 스냅샷 읽기 사이에 새 쓰기가 끼어들면 최신 revision으로 다시 시도
+        for _ in range(3):
+            try:
+                return _load_stock_snapshot(revision)
+            except StaleRevisionError:
+                revision = _read_local_revision()
+        return _load_stock_snapshot(revision)
     except Exception as e:
         st.error(f"❌ 데이터 로드 실패: {str(e)}")
-        # 빈 DataFrame 반환
-        columns = ["Symbol", "Name", "InterestDate", "Note", "MarketCap", "Installments", "Category", "BuyTransactions", "SellTransactions", "ChangeRate"]
-        return pd.DataFrame(columns=columns)
+        return StockSnapshot(0, [])
+
+# 종목 데이터 읽기 (통합 시트의 로컬 복제본)
+def load_stocks():
+    """종목 데이터를 수정 가능한 DataFrame 복사본으로 반환합니다 (통합 시트)."""
+    return get_stock_snapshot().stocks_df.copy()
+
+# 시트 셀 값 비교용 정규화 (빈 값/정수형 실수/문자열 차이 무시)
+def _sheet_cell_key(value):
+    try:
+        if pd.isna(value):
+            return ""
+    except (TypeError, ValueError):
+        pass
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+# 변경된 셀만 Google Sheets에 반영 (Symbol 기준 diff)
+class SheetLayoutChangedError(Exception):
+    """다른 세션이나 Apps Script가 시트 행을 추가/삭제하여 행 배치가 스냅샷과 달라짐"""
+
+def _write_stocks_delta(worksheet, existing_df, new_df):
+    """
+    마지막으로 로드한 스냅샷(existing_df)과 저장할 데이터(new_df)를 Symbol 기준으로 비교하여
+    변경된 셀은 batch_update 한 번으로, 신규 행은 append, 삭제된 행은 deleteDimension으로 반영합니다.
+    헤더 불일치나 빈/중복 Symbol로 행을 특정할 수 없으면 False를 반환하고 (전체 저장으로 대체),
+    시트의 현재 행 배치가 스냅샷과 다르면 SheetLayoutChangedError를 발생시킵니다 (다른 쪽 변경을 덮어쓰지 않도록).
+    """
+    columns = new_df.columns.tolist()
+    if existing_df.empty or 'Symbol' not in columns or existing_df.columns.tolist() != columns:
+        return False
+
+    old_symbols = [_sheet_cell_key(s) for s in existing_df['Symbol']]
+    new_symbols = [_sheet_cell_key(s) for s in new_df['Symbol']]
+    # 빈 Symbol이나 중복 Symbol이 있으면 행을 특정할 수 없음
+    if "" in old_symbols or "" in new_symbols:
+        return False
+    if len(set(old_symbols)) != len(old_symbols) or len(set(new_symbols)) != len(new_symbols):
+        return False
+
+    # 시트의 현재 행 배치가 스냅샷과 같은지 Symbol 열만 읽어서 확인
+    # (다른 세션이나 Apps Script가 행을 추가/삭제했다면 저장하지 않음 - 전체 저장은 그 행들을 지우게 됨)
+    symbol_col = columns.index('Symbol') + 1
+    live_symbols = [_sheet_cell_key(s) for s in worksheet.col_values(symbol_col)[1:]]
+    if live_symbols != old_symbols:
+        raise SheetLayoutChangedError("시트의 행 배치가 바뀌었습니다.")
+
+    old_rows = {
+        sym: (pos, [_sheet_cell_key(v) for v in values])
+        for pos, (sym, values) in enumerate(zip(old_symbols, existing_df.values.tolist()))
+    }
+
+    updates = []
+    appends = []
+    for sym, values in zip(new_symbols, new_df.values.tolist()):
+        if sym not in old_rows:
+            appends.append(values)
+            continue
+        pos, old_keys = old_rows[sym]
+        row_num = pos + 2  # 헤더 다음 행부터 시작
+        changed = [i for i, v in enumerate(values) if _sheet_cell_key(v) != old_keys[i]]
+        # 연속된 변경 셀은 하나의 범위로 묶기
+        run_start = None
+        for n, col_idx in enumerate(changed):
+            if run_start is None:
+                run_start = col_idx
+            if n + 1 == len(changed) or changed[n + 1] != col_idx + 1:
+                updates.append({
+                    'range': f"{rowcol_to_a1(row_num, run_start + 1)}:"
+                             f"{rowcol_to_a1(row_num, col_idx + 1)}",
+                    'values': [values[run_start:col_idx + 1]]
+                })
+                run_start = None
+
+    new_symbol_set = set(new_symbols)
+    deleted_rows = sorted(
+        (pos + 2 for sym, (pos, _) in old_rows.items() if sym not in new_symbol_set),
+        reverse=True
+    )
+
+    # 1) 셀 수정 (기존 행 번호 기준이므로 삭제보다 먼저)
+    if updates:
+        worksheet.batch_update(updates, value_input_option='USER_ENTERED')
+    # 2) 행 삭제 (아래쪽 행부터 삭제해야 행 번호가 밀리지 않음)
+    if deleted_rows:
+        worksheet.spreadsheet.batch_update({
+            'requests': [
+                {'deleteDimension': {'range': {
+                    'sheetId': worksheet.id,
+                    'dimension': 'ROWS',
+                    'startIndex': row_num - 1,
+                    'endIndex': row_num
+                }}}
+                for row_num in deleted_rows
+            ]
+        })
+    # 3) 신규 행 추가
+    if appends:
+        worksheet.append_rows(appends, value_input_option='USER_ENTERED', table_range='A1')
+
+    return True
+
+# 시트 행 배치가 바뀌어 저장을 취소했을 때: 최신 시트를 다시 받아두고 다음 화면에서 경고 표시
+def _handle_sheet_layout_changed():
+    try:
+        with_stocks_worksheet(_pull_stocks_from_sheet)
+    except Exception:
+        # 다시 받기에 실패하면 백그라운드 동기화가 갱신
+        pass
+    st.session_state["save_warning"] = "⚠️ 다른 곳에서 시트의 행이 추가/삭제되어 저장하지 않았습니다. 최신 데이터로 새로고침했으니 다시 시도해주세요."
 
 # Google Sheets에 데이터 저장 (통합 시트)
 def save_stocks(df):
-    """DataFrame을 Google Sheets에 저장합니다 (통합 시트)."""
+    """
+    DataFrame을 Google Sheets에 저장합니다 (통합 시트). 저장했으면 True.
+    다른 곳에서 시트 행이 추가/삭제되었으면 덮어쓰지 않고 False를 반환합니다 (경고는 다음 화면에 표시).
+    """
     try:
-        client = get_google_sheets_client()
-        spreadsheet = client.open(SPREADSHEET_NAME)
-        worksheet = spreadsheet.worksheet("Stocks")
-        
         # 안전장치: df가 비어있으면 저장하지 않음
         if df.empty:
             st.warning("⚠️ 저장할 데이터가 없습니다. 데이터가 사라지는 것을 방지하기 위해 저장을 건너뜁니다.")
@@ -852,10 +1466,17 @@ def save_stocks(df):
             st.warning("⚠️ 저장할 데이터가 없습니다. 데이터가 사라지는 것을 방지하기 위해 저장을 건너뜁니다.")
             return
         
-        # 기존 데이터 지우고 새 데이터 쓰기 (안전하게)
+        # 변경된 셀/행만 반영, diff 적용이 불가능하면 기존 데이터 지우고 새 데이터 쓰기 (안전하게)
+        def write(spreadsheet, worksheet):
+            if not _write_stocks_delta(worksheet, existing_df, df):
+                worksheet.clear()
+                worksheet.update(values, value_input_option='USER_ENTERED')
+        
         try:
-            worksheet.clear()
-            worksheet.update(values, value_input_option='USER_ENTERED')
+            with_stocks_worksheet(write)
+        except SheetLayoutChangedError:
+            _handle_sheet_layout_changed()
+            return False
         except Exception as update_error:
             # 업데이트 실패 시 기존 데이터 복원 시도
             st.error(f"❌ 데이터 저장 중 오류 발생: {str(update_error)}")
@@ -863,26 +1484,331 @@ def save_stocks(df):
             if not existing_df.empty:
                 try:
                     restore_values = [existing_df.columns.tolist()] + existing_df.fillna("").values.tolist()
-                    worksheet.clear()
-                    worksheet.update(restore_values, value_input_option='USER_ENTERED')
+                    def restore(spreadsheet, worksheet):
+                        worksheet.clear()
+                        worksheet.update(restore_values, value_input_option='USER_ENTERED')
+                    with_stocks_worksheet(restore)
                     st.info("기존 데이터로 복원을 시도했습니다.")
                 except:
                     pass
             raise
         
-        # 캐시 무효화 (다음 로드 시 최신 데이터 가져오기)
-        load_stocks.clear()
-        load_split_purchase_data.clear()  # 분할 매수 플래너 캐시도 초기화
+        # 로컬 저장소 갱신 (다음 로드 시 최신 데이터 사용)
+        _write_through_local_stocks(df)
+        return True
         
     except Exception as e:
         st.error(f"❌ 데이터 저장 실패: {str(e)}")
         raise
 
-# 주가 데이터 가져오기 (하이브리드 방식: FinanceDataReader + yfinance)
-@st.cache_data(ttl=7200)  # 2시간 캐싱 (rate limiting 방지)
-def get_stock_data(symbol):
+# ==========================================
+# 주가 데이터 로컬 저장소 (종목별 OHLCV, 최근 구간만 증분 갱신)
+# ==========================================
+
+def _init_ohlcv_store(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ohlcv (
+            symbol TEXT NOT NULL,
+            date TEXT NOT NULL,
+            open REAL, high REAL, low REAL, close REAL, volume REAL,
+            PRIMARY KEY (symbol, date)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ohlcv_meta (
+            symbol TEXT PRIMARY KEY,
+            last_date TEXT,
+            updated_at REAL NOT NULL,
+            version INTEGER NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS symbol_resolution (
+            symbol TEXT PRIMARY KEY,
+            provider TEXT NOT NULL,
+            fetch_symbol TEXT NOT NULL,
+            last_success REAL NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS weekly_bars (
+            symbol TEXT NOT NULL,
+            week TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            open REAL, high REAL, low REAL, close REAL,
+            sum20 REAL NOT NULL,
+            sum80 REAL NOT NULL,
+            PRIMARY KEY (symbol, week)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS fetch_failures (
+            symbol TEXT PRIMARY KEY,
+            reason TEXT NOT NULL,
+            failed_at REAL NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    """)
+
+# 종목 메타 정보 (마지막 저장일, 마지막 갱신 시각, 데이터 버전)
+def _read_ohlcv_meta(key):
+    conn = _connect_local_db(OHLCV_DB_PATH)
+    try:
+        _init_ohlcv_store(conn)
+        row = conn.execute(
+            "SELECT last_date, updated_at, version FROM ohlcv_meta WHERE symbol = ?", (key,)
+        ).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    return {'last_date': row[0], 'updated_at': row[1], 'version': row[2]}
+
+# 여러 종목의 저장된 데이터 버전 (쿼리 한 번) - {저장 키: 버전}, 저장소에 없는 종목은 빠짐
+def _read_ohlcv_versions(keys):
+    keys = list(keys)
+    if not keys:
+        return {}
+    conn = _connect_local_db(OHLCV_DB_PATH)
+    try:
+        _init_ohlcv_store(conn)
+        rows = conn.execute(
+            f"SELECT symbol, version FROM ohlcv_meta WHERE symbol IN ({','.join('?' * len(keys))})", keys
+        ).fetchall()
+    finally:
+        conn.close()
+    return dict(rows)
+
+# 저장된 일봉 행 수
+def _count_ohlcv_rows(key):
+    conn = _connect_local_db(OHLCV_DB_PATH)
+    try:
+        _init_ohlcv_store(conn)
+        return conn.execute("SELECT COUNT(*) FROM ohlcv WHERE symbol = ?", (key,)).fetchone()[0]
+    finally:
+        conn.close()
+
+# 저장된 일봉 전체 읽기
+def _read_ohlcv(key, since=None):
+    conn = _connect_local_db(OHLCV_DB_PATH)
+    try:
+        _init_ohlcv_store(conn)
+        if since is None:
+            df = pd.read_sql_query(
+                "SELECT date, open, high, low, close, volume FROM ohlcv WHERE symbol = ? ORDER BY date",
+                conn,
+                params=(key,)
+            )
+        else:
+            # since(YYYY-MM-DD) 이후 구간만
+            df = pd.read_sql_query(
+                "SELECT date, open, high, low, close, volume FROM ohlcv WHERE symbol = ? AND date >= ? ORDER BY date",
+                conn,
+                params=(key, since)
+            )
+    finally:
+        conn.close()
+    if df.empty:
+        return None
+    df.index = pd.DatetimeIndex(pd.to_datetime(df.pop('date')), name='Date')
+    df.columns = OHLCV_COLUMNS
+    return df
+
+# 일봉 저장 (replace=True면 해당 종목 전체 교체, 아니면 날짜 기준 upsert)
+def _write_ohlcv(key, df, replace=False):
+    rows = [
+        (key, idx.strftime("%Y-%m-%d"), *[None if pd.isna(v) else float(v) for v in values])
+        for idx, values in zip(df.index, df.reindex(columns=OHLCV_COLUMNS).itertuples(index=False, name=None))
+    ]
+    conn = _connect_local_db(OHLCV_DB_PATH)
+    try:
+        _init_ohlcv_store(conn)
+        with conn:
+            if replace:
+                conn.execute("DELETE FROM ohlcv WHERE symbol = ?", (key,))
+            conn.executemany(
+                "INSERT OR REPLACE INTO ohlcv (symbol, date, open, high, low, close, volume) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            # 주봉/이동평균은 새로 들어온 첫 날짜가 속한 주부터만 다시 계산
+            _update_weekly_bars(conn, key, None if replace or not rows else min(row[1] for row in rows))
+            last_date = conn.execute("SELECT MAX(date) FROM ohlcv WHERE symbol = ?", (key,)).fetchone()[0]
+            conn.execute(
+                "INSERT INTO ohlcv_meta (symbol, last_date, updated_at, version) VALUES (?, ?, ?, 1) "
+                "ON CONFLICT(symbol) DO UPDATE SET last_date = excluded.last_date, "
+                "updated_at = excluded.updated_at, version = ohlcv_meta.version + 1",
+                (key, last_date, time.time())
+            )
+            conn.execute("DELETE FROM fetch_failures WHERE symbol = ?", (key,))
+    finally:
+        conn.close()
+
+# 날짜가 속한 주의 금요일 (W-FRI 주봉 기준일)
+def _week_label(day):
+    return day + timedelta(days=(4 - day.weekday()) % 7)
+
+# 주봉(W-FRI) 및 20주/80주 이동합계 갱신 (_write_ohlcv와 같은 트랜잭션에서 호출)
+def _update_weekly_bars(conn, key, since_date=None):
+    """
+    since_date가 속한 주부터 주봉을 다시 만들고, 직전 80주 종가와 이동합계를 이어받아
+    새 주마다 sum += 새 종가 - 빠지는 종가 로 갱신합니다. since_date가 None이면 전체 재계산.
+    """
+    if since_date is None:
+        conn.execute("DELETE FROM weekly_bars WHERE symbol = ?", (key,))
+        daily = pd.read_sql_query(
+            "SELECT date, open, high, low, close FROM ohlcv WHERE symbol = ? ORDER BY date",
+            conn, params=(key,)
+        )
+        previous = []
+    else:
+        first_label = _week_label(datetime.strptime(since_date, "%Y-%m-%d").date())
+        week_start = (first_label - timedelta(days=6)).strftime("%Y-%m-%d")
+        first_label = first_label.strftime("%Y-%m-%d")
+        conn.execute("DELETE FROM weekly_bars WHERE symbol = ? AND week >= ?", (key, first_label))
+        daily = pd.read_sql_query(
+            "SELECT date, open, high, low, close FROM ohlcv WHERE symbol = ? AND date >= ? ORDER BY date",
+            conn, params=(key, week_start)
+        )
+        previous = conn.execute(
+            "SELECT seq, close, sum20, sum80 FROM weekly_bars WHERE symbol = ? AND week < ? "
+            "ORDER BY week DESC LIMIT 80",
+            (key, first_label)
+        ).fetchall()[::-1]
+    
+    if daily.empty:
+        return
+    daily.index = pd.DatetimeIndex(pd.to_datetime(daily.pop('date')))
+    weekly = daily.resample('W-FRI').agg({
+        'open': 'first',
+        'high': 'max',
+        'low': 'min',
+        'close': 'last'
+    }).dropna()
+    
+    # 직전 주까지의 상태 (최근 80주 종가, 순번, 이동합계)
+    window = [row[1] for row in previous]
+    if previous:
+        seq, sum20, sum80 = previous[-1][0], previous[-1][2], previous[-1][3]
+    else:
+        seq, sum20, sum80 = 0, 0.0, 0.0
+    rows = []
+    for week, (open_, high, low, close) in zip(weekly.index, weekly.itertuples(index=False, name=None)):
+        window.append(close)
+        seq += 1
+        sum20 += close - (window[-21] if len(window) > 20 else 0.0)
+        sum80 += close - (window[-81] if len(window) > 80 else 0.0)
+        del window[:-80]
+        rows.append((key, week.strftime("%Y-%m-%d"), seq, open_, high, low, close, sum20, sum80))
+    conn.executemany(
+        "INSERT INTO weekly_bars (symbol, week, seq, open, high, low, close, sum20, sum80) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        rows
+    )
+
+# 저장된 주봉 + 20주/80주 이동평균 읽기 (이전 버전 저장소면 주봉을 한 번 만들어 둠)
+def _read_weekly_bars(key):
+    conn = _connect_local_db(OHLCV_DB_PATH)
+    try:
+        _init_ohlcv_store(conn)
+        query = (
+            "SELECT week, open, high, low, close, "
+            "CASE WHEN seq >= 20 THEN sum20 / 20.0 END, CASE WHEN seq >= 80 THEN sum80 / 80.0 END "
+            "FROM weekly_bars WHERE symbol = ? ORDER BY week"
+        )
+        df = pd.read_sql_query(query, conn, params=(key,))
+        if df.empty:
+            with conn:
+                _update_weekly_bars(conn, key)
+            df = pd.read_sql_query(query, conn, params=(key,))
+    finally:
+        conn.close()
+    if df.empty:
+        return None
+    df.index = pd.DatetimeIndex(pd.to_datetime(df.pop('week')), name='Date')
+    df.columns = ['Open', 'High', 'Low', 'Close', 'MA20', 'MA80']
+    return df
+
+# 새 데이터가 없거나 가져오기에 실패했을 때 갱신 시각만 기록 (OHLCV_REFRESH_INTERVAL 동안 재요청 방지)
+def _touch_ohlcv_meta(key):
+    conn = _connect_local_db(OHLCV_DB_PATH)
+    try:
+        _init_ohlcv_store(conn)
+        with conn:
+            conn.execute("UPDATE ohlcv_meta SET updated_at = ? WHERE symbol = ?", (time.time(), key))
+    finally:
+        conn.close()
+
+# 아직 유효한 조회 실패 기록의 사유 (없으면 None)
+def _read_fetch_failure(key):
+    conn = _connect_local_db(OHLCV_DB_PATH)
+    try:
+        _init_ohlcv_store(conn)
+        row = conn.execute(
+            "SELECT reason FROM fetch_failures WHERE symbol = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+    finally:
+        conn.close()
+    return row[0] if row else None
+
+# 조회 실패 기록 (사유별 NEGATIVE_CACHE_TTL 동안 재요청하지 않음)
+def _write_fetch_failure(key, reason):
+    now = time.time()
+    conn = _connect_local_db(OHLCV_DB_PATH)
+    try:
+        _init_ohlcv_store(conn)
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO fetch_failures (symbol, reason, failed_at, expires_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, reason, now, now + NEGATIVE_CACHE_TTL[reason])
+            )
+    finally:
+        conn.close()
+
+# 조회 실패 사유 분류
+def _classify_fetch_error(error):
+    if isinstance(error, CircuitOpenError) or _is_rate_limit_error(error):
+        return "rate_limited"
+    if isinstance(error, (ValueError, KeyError, TypeError, IndexError)):
+        # json.JSONDecodeError도 ValueError의 하위 클래스
+        return "parse_error"
+    return "fetch_error"
+
+# 마지막으로 성공한 조회 경로 (제공자, 실제 요청 심볼) - 없으면 None
+def _read_symbol_resolution(key):
+    conn = _connect_local_db(OHLCV_DB_PATH)
+    try:
+        _init_ohlcv_store(conn)
+        row = conn.execute(
+            "SELECT provider, fetch_symbol FROM symbol_resolution WHERE symbol = ?", (key,)
+        ).fetchone()
+    finally:
+        conn.close()
+    return (row[0], row[1]) if row else None
+
+# 조회에 성공한 경로 기록 (다음 조회부터 .KS/.KQ 탐색 없이 바로 요청)
+def _write_symbol_resolution(key, provider, fetch_symbol):
+    conn = _connect_local_db(OHLCV_DB_PATH)
+    try:
+        _init_ohlcv_store(conn)
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO symbol_resolution (symbol, provider, fetch_symbol, last_success) "
+                "VALUES (?, ?, ?, ?)",
+                (key, provider, fetch_symbol, time.time())
+            )
+    finally:
+        conn.close()
+
+# 종목 코드 정규화
+def _parse_symbol(symbol):
+    """
+    종목 코드를 (저장 키, 원본 문자열, 정제 코드, 한국 종목 여부, 시장 접미사)로 변환합니다.
+    유효하지 않으면 None을 반환합니다.
+    """
     # symbol 유효성 검사
-    if symbol is None:
+    if symbol is None or symbol is pd.NA:
         return None
     
     # symbol을 문자열로 변환 (0으로 시작하는 종목번호 보존)
@@ -899,9 +1825,6 @@ def get_stock_data(symbol):
     except Exception:
         return None
     
-    max_retries = 3
-    retry_delay = 2  # 초기 지연 시간 (초)
-    
     # 1. 한국 종목 코드 정제 (숫자 6자리 추출, 앞의 0 보존)
     clean_symbol = symbol_str.upper()
     is_korean = False
@@ -924,244 +1847,1415 @@ def get_stock_data(symbol):
         clean_symbol = clean_symbol.zfill(6)
         is_korean = True
     
-    for attempt in range(max_retries):
+    return {
+        'key': symbol_str.upper(),
+        'symbol_str': symbol_str,
+        'clean_symbol': clean_symbol,
+        'is_korean': is_korean,
+        'market_suffix': market_suffix
+    }
+
+# 제공자별 일봉 데이터를 표준 형식으로 변환
+def _standardize_ohlcv(df):
+    # 4. 데이터 표준화 (차트 호환성 유지)
+    # 인덱스 이름 'Date'로 통일
+    if df.index.name != 'Date':
+        df.index.name = 'Date'
+    
+    # 타임존 제거 (yfinance는 타임존이 있고, fdr은 없을 수 있음)
+    if df.index.tz is not None:
+        df.index = df.index.tz_localize(None)
+    
+    # 날짜 정규화 (시간 제거)
+    df.index = pd.to_datetime(df.index).normalize()
+    
+    # 컬럼명 표준화 (대소문자 통일: Open, High, Low, Close, Volume)
+    column_mapping = {}
+    for col in df.columns:
+        col_lower = str(col).lower()
+        if col_lower in ['open', '시가']:
+            column_mapping[col] = 'Open'
+        elif col_lower in ['high', '고가']:
+            column_mapping[col] = 'High'
+        elif col_lower in ['low', '저가']:
+            column_mapping[col] = 'Low'
+        elif col_lower in ['close', '종가']:
+            column_mapping[col] = 'Close'
+        elif col_lower in ['volume', '거래량']:
+            column_mapping[col] = 'Volume'
+    
+    if column_mapping:
+        df = df.rename(columns=column_mapping)
+    
+    # 저장소에는 OHLCV 컬럼만 보관 (중복 날짜는 마지막 값 사용)
+    df = df[[col for col in OHLCV_COLUMNS if col in df.columns]]
+    df = df[~df.index.duplicated(keep='last')].sort_index()
+    return df
+
+# 조회 경로 후보 (제공자, 요청 심볼) - 앞에서부터 차례로 시도
+def _fetch_candidates(parsed):
+    clean_symbol = parsed['clean_symbol']
+    market_suffix = parsed['market_suffix']
+    
+    if not parsed['is_korean']:
+        # 한국 종목이 아니면 원본 그대로 yfinance 사용
+        return [("yfinance", parsed['symbol_str'])]
+    
+    candidates = []
+    # 1. FinanceDataReader (한국 종목)
+    if FDR_AVAILABLE:
+        candidates.append(("fdr", clean_symbol))
+    # 2. yfinance (FDR 실패 시) - 원본에 접미사가 있으면 그대로, 없으면 .KS 다음 .KQ
+    if market_suffix:
+        candidates.append(("yfinance", clean_symbol + market_suffix))
+    else:
+        candidates.append(("yfinance", clean_symbol + '.KS'))
+        candidates.append(("yfinance", clean_symbol + '.KQ'))
+    return candidates
+
+# 제공자 한 곳에서 일봉 요청 (start_str이 없으면 전체 기간)
+def _fetch_from_provider(provider, fetch_symbol, start_str):
+    if provider == "fdr":
+        df = call_provider("fdr", fdr.DataReader, fetch_symbol, start_str)
+        # FinanceDataReader는 인덱스가 Date가 아닐 수 있으므로 확인
+        if df is not None and not df.empty and df.index.name != 'Date':
+            df.index.name = 'Date'
+        return df
+    ticker = yf.Ticker(fetch_symbol)
+    if start_str:
+        return call_provider("yfinance", ticker.history, start=start_str)
+    return call_provider("yfinance", ticker.history, period="max")
+
+# 주가 데이터 다운로드 (하이브리드 방식: FinanceDataReader + yfinance)
+def _fetch_ohlcv(parsed, start=None):
+    """
+    FinanceDataReader(한국 종목) 또는 yfinance로 일봉을 받아옵니다.
+    start가 주어지면 그 날짜 이후 구간만 요청합니다. 실패 시 None.
+    마지막으로 성공한 (제공자, 요청 심볼)을 먼저 시도하고, 새로 성공한 경로는 저장해 둡니다.
+    """
+    key = parsed['key']
+    start_str = start.strftime("%Y-%m-%d") if start is not None else None
+    
+    candidates = _fetch_candidates(parsed)
+    resolved = _read_symbol_resolution(key)
+    if resolved is not None:
+        candidates = [resolved] + [c for c in candidates if c != resolved]
+    
+    # 재시도/대기는 하지 않음: 요청 속도는 제공자별 토큰 버킷이 조절하고,
+    # 요청 과다(429)와 서킷 브레이커 차단은 호출자에게 전달되어 저장된 데이터를 그대로 사용
+    last_error = None
+    got_empty = False
+    for provider, fetch_symbol in candidates:
         try:
-            # 요청 간 지연 (rate limiting 방지)
-            if attempt > 0:
-                time.sleep(retry_delay * (attempt + 1))  # 지수 백오프
-            
-            df = None
-            
-            # 2. FinanceDataReader 사용 (한국 종목)
-            if is_korean and FDR_AVAILABLE:
+            df = _fetch_from_provider(provider, fetch_symbol, start_str)
+        except Exception as e:
+            # FinanceDataReader 실패(차단 포함) 시 yfinance로 폴백
+            if provider == "fdr" or not (isinstance(e, CircuitOpenError) or _is_rate_limit_error(e)):
+                last_error = e
+                continue
+            # 요청 과다는 갱신 시각을 남기지 않도록 그대로 전달 (다음 갱신 때 다시 시도)
+            raise
+        
+        # 빈 데이터면 다음 후보 시도 (오류 메시지 숨김)
+        if df is None or df.empty:
+            got_empty = True
+            continue
+        
+        _write_symbol_resolution(key, provider, fetch_symbol)
+        return _standardize_ohlcv(df)
+    
+    # 모든 경로가 오류였으면 마지막 오류를 전달 (실패 사유 기록용)
+    if last_error is not None and not got_empty:
+        raise last_error
+    return None
+
+# 저장소 갱신 (최초에는 전체 이력, 이후에는 마지막 저장일 근처부터의 꼬리 구간만)
+def _refresh_ohlcv(parsed):
+    key = parsed['key']
+    meta = _read_ohlcv_meta(key)
+    
+    if meta is None or not meta['last_date']:
+        full = _fetch_ohlcv(parsed)
+        if full is None or full.empty:
+            return False
+        _write_ohlcv(key, full, replace=True)
+        return True
+    
+    last_date = pd.Timestamp(meta['last_date'])
+    overlap_start = last_date - timedelta(days=OHLCV_OVERLAP_DAYS)
+    tail = _fetch_ohlcv(parsed, start=overlap_start)
+    if tail is None or tail.empty:
+        _touch_ohlcv_meta(key)
+        return False
+    
+    # 겹치는 구간만 저장소에서 읽기 (전체 이력은 읽지 않음)
+    stored = _read_ohlcv(key, since=overlap_start.strftime("%Y-%m-%d"))
+    if stored is None:
+        stored = pd.DataFrame(columns=OHLCV_COLUMNS, index=pd.DatetimeIndex([], name='Date'))
+    
+    # 겹치는 구간(마지막 저장일 이전)의 종가가 달라졌으면 수정주가가 바뀐 것이므로 전체 다시 받기
+    # (마지막 저장일은 장중에 저장된 미완성 봉일 수 있으므로 비교에서 제외)
+    common = stored.index[stored.index < last_date].intersection(tail.index)
+    if len(common) > 0 and 'Close' in tail.columns:
+        if not np.allclose(
+            stored.loc[common, 'Close'].to_numpy(dtype=float),
+            tail.loc[common, 'Close'].to_numpy(dtype=float),
+            rtol=1e-4,
+            equal_nan=True
+        ):
+            full = _fetch_ohlcv(parsed)
+            if full is not None and not full.empty:
+                _write_ohlcv(key, full, replace=True)
+                return True
+    
+    # 마지막 저장일(미완성 봉 갱신) 이후 구간만 추가
+    _write_ohlcv(key, tail[tail.index >= last_date])
+    return True
+
+# 읽기 전용 DataFrame으로 변환 (하나의 float 배열 위에 쓰기 금지로 만듦) - 캐시된 프레임을 복사 없이 공유하기 위함
+def _freeze_frame(df):
+    if df is None:
+        return None
+    values = df.to_numpy(dtype=float)
+    values.flags.writeable = False
+    return pd.DataFrame(values, index=df.index, columns=df.columns, copy=False)
+
+# 정렬된 날짜 인덱스에서 [start, end] 구간 보기 (이진 탐색, 복사 없음)
+def ohlcv_range_view(frame, start=None, end=None):
+    """
+    저장소에서 읽은 일봉/주봉 프레임의 start~end(양 끝 포함, None이면 열린 구간) 구간을 반환합니다.
+    인덱스가 날짜순으로 정렬되어 있으므로 slice_indexer로 위치만 찾아 잘라내며, 원본과 같은 메모리를 가리킵니다.
+    """
+    if frame is None:
+        return None
+    return frame.iloc[frame.index.slice_indexer(start, end)]
+
+# 저장소에서 종목 일봉 읽기 (데이터 버전이 바뀔 때만 다시 읽음, 읽기 전용 - 모든 세션이 같은 객체 공유)
+@st.cache_resource(max_entries=200)
+def _load_ohlcv_frame(key, version):
+    return _freeze_frame(_read_ohlcv(key))
+
+# 저장소가 오래되었으면 갱신하고 메타 정보 반환 (Streamlit 호출 없음 - 작업 스레드에서 사용 가능)
+def _ensure_ohlcv_fresh(parsed, force=False):
+    """
+    최근 조회 실패 기록이 남아 있으면 요청하지 않고 저장된 데이터(없으면 None)를 그대로 사용합니다.
+    새로 실패하면 사유(not_found / rate_limited / parse_error / fetch_error)를 기록합니다.
+    force=True면 마지막 갱신 시각과 관계없이 갱신합니다 (장 마감 후 미리 받기).
+    """
+    key = parsed['key']
+    meta = _read_ohlcv_meta(key)
+    if force or meta is None or time.time() - meta['updated_at'] > OHLCV_REFRESH_INTERVAL:
+        if _read_fetch_failure(key) is not None:
+            return meta
+        try:
+            _refresh_ohlcv(parsed)
+        except Exception as e:
+            # 갱신 실패 시 저장된 데이터가 있으면 그대로 사용
+            _write_fetch_failure(key, _classify_fetch_error(e))
+        meta = _read_ohlcv_meta(key)
+        if meta is None and _read_fetch_failure(key) is None:
+            # 오류 없이 빈 데이터만 돌아온 종목 (상장폐지/오타 등)
+            _write_fetch_failure(key, "not_found")
+    return meta
+
+# 종목의 저장 키와 데이터 버전 (저장소가 오래되었으면 먼저 갱신) - 데이터가 없으면 None
+def get_ohlcv_version(symbol):
+    parsed = _parse_symbol(symbol)
+    if parsed is None:
+        return None
+    
+    meta = _ensure_ohlcv_fresh(parsed)
+    if meta is None:
+        return None
+    return parsed['key'], meta['version']
+
+# 저장소에서 종목 주봉/이동평균 읽기 (데이터 버전이 바뀔 때만 다시 읽음, 읽기 전용 - 모든 세션이 같은 객체 공유)
+@st.cache_resource(max_entries=200)
+def _load_weekly_frame(key, version):
+    return _freeze_frame(_read_weekly_bars(key))
+
+# 여러 종목 저장소 일괄 갱신 (병렬, force_markets에 속한 종목은 강제 갱신) - {symbol: (저장 키, 데이터 버전) 또는 None}
+def _ensure_ohlcv_fresh_many(symbols, max_workers=PRICE_FETCH_WORKERS, force_markets=()):
+    parsed_by_symbol = {}
+    for symbol in symbols:
+        if symbol not in parsed_by_symbol:
+            parsed_by_symbol[symbol] = _parse_symbol(symbol)
+    
+    # 같은 저장 키는 한 번만 갱신
+    pending = {}
+    for parsed in parsed_by_symbol.values():
+        if parsed is not None:
+            pending.setdefault(parsed['key'], parsed)
+    
+    metas = {}
+    if pending:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pending)))) as executor:
+            futures = {
+                executor.submit(_ensure_ohlcv_fresh, parsed, _market_of(parsed) in force_markets): key
+                for key, parsed in pending.items()
+            }
+            for future in as_completed(futures):
                 try:
-                    df = fdr.DataReader(clean_symbol)
-                    # FinanceDataReader는 인덱스가 Date가 아닐 수 있으므로 확인
-                    if df is not None and not df.empty:
-                        # 인덱스 이름이 없거나 다른 경우 'Date'로 설정
-                        if df.index.name is None or df.index.name != 'Date':
-                            df.index.name = 'Date'
-                except Exception as fdr_error:
-                    # FinanceDataReader 실패 시 yfinance로 폴백
-                    df = None
-            
-            # 3. yfinance 사용 (미국 종목 또는 FDR 실패 시)
-            if df is None or df.empty:
-                # yfinance는 .KS/.KQ가 필요할 수 있으므로 원본 symbol 사용 시도
-                # 한국 종목인 경우 접미사 추가
-                yf_symbol = symbol_str
-                if is_korean:
-                    if market_suffix:
-                        # 원본에 접미사가 있었으면 그대로 사용
-                        yf_symbol = clean_symbol + market_suffix
-                        ticker = yf.Ticker(yf_symbol)
-                        df = ticker.history(period="max")
-                    else:
-                        # 접미사가 없으면 FinanceDataReader가 실패했으므로
-                        # .KS와 .KQ를 모두 시도 (먼저 .KS 시도)
-                        yf_symbol = clean_symbol + '.KS'
-                        ticker = yf.Ticker(yf_symbol)
-                        df = ticker.history(period="max")
-                        
-                        # .KS로 실패하면 .KQ 시도
-                        if df is None or df.empty:
-                            yf_symbol = clean_symbol + '.KQ'
-                            ticker = yf.Ticker(yf_symbol)
-                            df = ticker.history(period="max")
-                else:
-                    # 한국 종목이 아니면 원본 그대로 사용
-                    ticker = yf.Ticker(yf_symbol)
-                    df = ticker.history(period="max")
-            
-            # 빈 데이터 체크
-            if df is None or df.empty:
-                if attempt < max_retries - 1:
-                    continue
-                # 오류 메시지 숨김
-                return None
+                    metas[futures[future]] = future.result()
+                except Exception:
+                    metas[futures[future]] = None
+    
+    results = {}
+    for symbol, parsed in parsed_by_symbol.items():
+        meta = metas.get(parsed['key']) if parsed is not None else None
+        results[symbol] = (parsed['key'], meta['version']) if meta is not None else None
+    return results
+
+# 여러 종목 주가 데이터 일괄 조회 (병렬)
+def get_stock_data_many(symbols, max_workers=PRICE_FETCH_WORKERS):
+    """
+    여러 종목의 일봉을 제한된 스레드 풀로 병렬 갱신한 뒤 {symbol: DataFrame 또는 None}으로 반환합니다.
+    요청 속도는 제공자별 요청 제한기(동시 요청 수, 토큰 버킷, 서킷 브레이커)로 제한됩니다.
+    반환된 DataFrame은 모든 세션이 공유하는 읽기 전용 프레임입니다.
+    """
+    versions = _ensure_ohlcv_fresh_many(symbols, max_workers)
+    return {
+        symbol: _load_ohlcv_frame(*key_version) if key_version is not None else None
+        for symbol, key_version in versions.items()
+    }
+
+# ==========================================
+# 백그라운드 주가 미리 받기 (장 마감 후 스케줄러)
+# ==========================================
+
+# 종목의 시장 구분 (마감 시각 기준)
+def _market_of(parsed):
+    return "KRX" if parsed['is_korean'] else "US"
+
+# 가장 최근 장 마감 시각 (주말 제외, 종가 확정 대기 시간 포함)
+def _last_market_close(market, now=None):
+    tz, hour, minute = MARKET_CLOSE_TIMES[market]
+    local_now = (now or pd.Timestamp.now(tz="UTC")).tz_convert(tz)
+    close = local_now.normalize() + pd.Timedelta(hours=hour, minutes=minute + PREFETCH_SETTLE_MINUTES)
+    if close > local_now:
+        close -= pd.DateOffset(days=1)
+    while close.weekday() >= 5:
+        close -= pd.DateOffset(days=1)
+    return close
+
+# 시트 종목을 우선순위별 묶음으로 나누기 - [보유 종목(매수 내역 있음), 나머지]
+def _prefetch_batches(records):
+    holdings = []
+    others = []
+    seen = set()
+    for record in records:
+        symbol = record.get('Symbol')
+        parsed = _parse_symbol(symbol)
+        if parsed is None or not parsed['clean_symbol'] or parsed['key'] in seen:
+            continue
+        seen.add(parsed['key'])
+        (holdings if parse_transactions(record.get('BuyTransactions')) else others).append(symbol)
+    return [holdings, others]
+
+# 묶음 순서대로 저장소 병렬 갱신 (force_markets에 속한 종목은 강제 갱신)
+def _run_prefetch(records, force_markets=()):
+    for batch in _prefetch_batches(records):
+        if batch:
+            # 종목별 실패는 _ensure_ohlcv_fresh_many 안에서 None으로 처리됨 (실패 사유는 별도 기록)
+            _ensure_ohlcv_fresh_many(batch, force_markets=force_markets)
+
+# 백그라운드 주가 미리 받기 스레드 (프로세스당 한 번만 시작)
+@st.cache_resource
+def start_price_prefetch():
+    """
+    시작 시 시트의 모든 종목 일봉을 미리 받아두고, 이후 PREFETCH_POLL_INTERVAL마다
+    시장별 장 마감(KRX 15:30 KST, 미국 16:00 ET)이 지났으면 해당 시장 종목을 강제 갱신합니다.
+    시트가 바뀌면(revision 변경) 모든 종목을 확인하여 저장소에 없거나 OHLCV_REFRESH_INTERVAL이 지난 종목을 받아옵니다.
+    갱신은 PRICE_FETCH_WORKERS개 스레드로 병렬 처리하며, 보유 종목 묶음이 항상 먼저 처리됩니다.
+    """
+    def worker():
+        done_closes = {market: _last_market_close(market) for market in MARKET_CLOSE_TIMES}
+        last_revision = None
+        while True:
+            try:
+                local = _read_local_stocks()
+                if local is not None:
+                    force_markets = set()
+                    for market in MARKET_CLOSE_TIMES:
+                        close = _last_market_close(market)
+                        if close > done_closes[market]:
+                            force_markets.add(market)
+                            done_closes[market] = close
+                    if force_markets or local['revision'] != last_revision:
+                        _run_prefetch(local['records'], force_markets)
+                        last_revision = local['revision']
+            except Exception:
+                # 저장소 오류 시 다음 주기에 재시도
+                pass
+            time.sleep(PREFETCH_POLL_INTERVAL)
+    
+    thread = threading.Thread(target=worker, name="price-prefetch", daemon=True)
+    thread.start()
+    return thread
+
+# ==========================================
+# 종목 차트 (봉 단위 선택 + Figure 캐시)
+# ==========================================
+
+# 차트에 그릴 봉 단위 선택 및 묶기 - (봉 데이터, 봉 단위 이름)
+def decimate_ohlcv(stock_data, target_width_px=CHART_TARGET_WIDTH_PX, min_px_per_bar=CHART_MIN_PX_PER_BAR):
+    """
+    보이는 구간의 일봉을 차트 폭에 맞는 봉 단위(일봉 → 주봉 → 월봉 → 분기봉)로 묶습니다.
+    봉 수가 target_width_px / min_px_per_bar 이하가 되는 가장 짧은 단위를 고르며,
+    묶을 때는 시가=첫 값, 고가=최대, 저가=최소, 종가=마지막 값을 사용하므로 구간의 최고/최저가는 그대로 보존됩니다.
+    """
+    max_bars = max(1, int(target_width_px // min_px_per_bar))
+    bars, label = stock_data, CHART_BAR_RULES[0][0]
+    for label, rule in CHART_BAR_RULES:
+        if rule is None:
+            bars = stock_data
+        else:
+            aggregations = {'Open': 'first', 'High': 'max', 'Low': 'min', 'Close': 'last'}
+            if 'Volume' in stock_data.columns:
+                aggregations['Volume'] = 'sum'
+            bars = stock_data.resample(rule).agg(aggregations).dropna(subset=['Close'])
+        if len(bars) <= max_bars:
+            break
+    return bars, label
+
+# 관심일/매수일/매도일 표시 위치 계산 - 표시할 것이 없으면 None
+def _layout_trade_markers(stock_data, interest_date, buy_transactions, sell_transactions):
+    """
+    모든 날짜를 한 번에 파싱한 뒤 DatetimeIndex.searchsorted 한 번으로 거래일에 맞춥니다.
+    주말/휴장일이면 다음 거래일, 구간 끝 이후면 마지막 거래일을 사용합니다.
+    관심일은 고가 위, 매수일은 매수가(없으면 저가) 아래, 매도일은 매도가(없으면 고가)에 표시합니다.
+    """
+    if stock_data is None or len(stock_data.index) == 0:
+        return None
+    
+    # (종류, 날짜 문자열, 거래 가격, 표시 문구)
+    entries = []
+    if pd.notna(interest_date) and str(interest_date).strip() != "":
+        entries.append(('interest', str(interest_date), 0, "👀 관심"))
+    for kind, transactions, label in (('buy', buy_transactions, "🔴 매수"), ('sell', sell_transactions, "🔵 매도")):
+        for idx, tx in enumerate(transactions):
+            date_val = tx.get('date', '') if isinstance(tx, dict) else (str(tx) if tx else '')
+            if not date_val or str(date_val).strip() == "":
+                continue
+            tx_price = tx.get('price', 0) if isinstance(tx, dict) else 0
+            entries.append((kind, str(date_val), tx_price, label if idx == 0 else f"{label}{idx+1}"))
+    if not entries:
+        return None
+    
+    kinds = np.array([entry[0] for entry in entries])
+    dates = pd.to_datetime(pd.Series([entry[1] for entry in entries]), errors='coerce').dt.normalize()
+    valid = dates.notna().to_numpy()
+    if not valid.any():
+        return None
+    
+    index = stock_data.index
+    positions = np.minimum(index.searchsorted(dates[valid].to_numpy(), side='left'), len(index) - 1)
+    highs = stock_data['High'].to_numpy(dtype=float)
+    lows = stock_data['Low'].to_numpy(dtype=float)
+    offset = (np.nanmax(highs) - np.nanmin(lows)) * 0.01  # 가격 범위의 1%
+    
+    kinds = kinds[valid]
+    tx_prices = pd.to_numeric(pd.Series([entry[2] for entry in entries])[valid], errors='coerce').to_numpy(dtype=float)
+    has_price = np.nan_to_num(tx_prices) > 0
+    is_interest = kinds == 'interest'
+    is_buy = kinds == 'buy'
+    
+    price = np.where(is_buy, lows[positions], highs[positions])
+    price = np.where(has_price & ~is_interest, tx_prices, price)
+    y = np.where(is_interest, price + offset, np.where(is_buy, price - offset, price))
+    
+    styles = {
+        'interest': ('#FFD700', 'triangle-down', 'top center'),
+        'buy': ('#FF2E2E', 'triangle-up', 'bottom center'),
+        'sell': ('#00C4FF', 'circle', 'top center'),
+    }
+    return {
+        'x': index[positions],
+        'y': y,
+        'price': price,
+        'text': [entry[3] for entry, ok in zip(entries, valid) if ok],
+        'color': [styles[kind][0] for kind in kinds],
+        'symbol': [styles[kind][1] for kind in kinds],
+        'textposition': [styles[kind][2] for kind in kinds],
+    }
+
+# 종목 매수/매도 기록 해시 (차트 캐시 키)
+def _transactions_hash(buy_transactions, sell_transactions):
+    payload = json.dumps([buy_transactions, sell_transactions], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+# 종목 차트 Figure 만들기 (JSON) - 종목, 구간, 데이터 버전, 관심일, 매수/매도 기록이 같으면 다시 만들지 않음
+@st.cache_data(max_entries=64)
+def build_stock_chart_json(key, version, symbol, name, range_start, range_end, interest_date, tx_hash, _buy_transactions, _sell_transactions):
+    """
+    저장된 일봉(key, version)의 [range_start, range_end] 구간으로 캔들스틱 + 20/80주 이동평균 + 관심/매수/매도 표시가
+    들어간 차트를 만들어 Plotly JSON으로 반환합니다. 매수/매도 기록은 해시(tx_hash)로만 캐시 키에 포함됩니다.
+    """
+    stock_data = ohlcv_range_view(_load_ohlcv_frame(key, version), range_start, range_end)
+    buy_transactions = _buy_transactions
+    sell_transactions = _sell_transactions
+    
+    # 캔들스틱 차트 생성
+    fig = go.Figure()
+    
+    # 기간이 길면 주봉/월봉으로 묶어서 그림 (봉 수를 차트 폭에 맞춤)
+    chart_bars, bar_label = decimate_ohlcv(stock_data)
+    
+    # 캔들스틱 차트 추가 (한국 스타일 색상)
+    fig.add_trace(go.Candlestick(
+        x=chart_bars.index,
+        open=chart_bars['Open'],
+        high=chart_bars['High'],
+        low=chart_bars['Low'],
+        close=chart_bars['Close'],
+        name=f"주가 ({bar_label})",
+        increasing=dict(
+            line=dict(color='#FF2E2E'),  # 상승: 빨강
+            fillcolor='#FF2E2E'
+        ),
+        decreasing=dict(
+            line=dict(color='#00C4FF'),  # 하락: 파랑
+            fillcolor='#00C4FF'
+        )
+    ))
+    
+    # 20주 이동평균선 및 80주 이동평균선 추가
+    # (저장소에 미리 계산된 W-FRI 주봉 이동평균 사용 - 전체 이력 기준)
+    try:
+        weekly_data = _load_weekly_frame(key, version)
+        if weekly_data is None:
+            weekly_data = pd.DataFrame(columns=['MA20', 'MA80'])
+        elif len(stock_data.index) > 0:
+            # 보이는 구간의 주만 주봉 해상도 그대로 사용 (일봉으로 늘리지 않음)
+            weekly_data = ohlcv_range_view(weekly_data, stock_data.index[0], stock_data.index[-1] + timedelta(days=6))
+        
+        # 20주 이동평균
+        if weekly_data['MA20'].notna().any():
+            fig.add_trace(go.Scatter(
+                x=weekly_data.index,
+                y=weekly_data['MA20'],
+                mode='lines',
+                name='20주 이동평균',
+                line=dict(color='#FF8C00', width=2),  # 주황색 (DarkOrange)
+                hovertemplate='20주 MA: %{y:.2f}<extra></extra>'
+            ))
+        
+        # 80주 이동평균
+        if weekly_data['MA80'].notna().any():
+            fig.add_trace(go.Scatter(
+                x=weekly_data.index,
+                y=weekly_data['MA80'],
+                mode='lines',
+                name='80주 이동평균',
+                line=dict(color='#32CD32', width=2),  # 초록색 (LimeGreen)
+                hovertemplate='80주 MA: %{y:.2f}<extra></extra>'
+            ))
+    except Exception as e:
+        # 이동평균 계산 실패 시 무시 (차트는 정상 표시)
+        pass
+
+    
+    # 관심/매수/매도 표시 (모든 날짜를 한 번에 거래일로 맞춰서 하나의 trace로 추가)
+    markers = _layout_trade_markers(stock_data, interest_date, buy_transactions, sell_transactions)
+    if markers is not None:
+        fig.add_trace(go.Scatter(
+            x=markers['x'],
+            y=markers['y'],
+            mode='markers+text',
+            text=markers['text'],
+            textposition=markers['textposition'],
+            textfont=dict(size=14, color=markers['color']),
+            marker=dict(
+                symbol=markers['symbol'],
+                size=18,
+                color=markers['color'],
+                line=dict(width=2, color='rgba(0, 0, 0, 0.5)')
+            ),
+            customdata=markers['price'],
+            name="관심/매수/매도",
+            hovertemplate="%{text}: %{x|%Y-%m-%d}<br>가격: %{customdata:,.2f}<extra></extra>"
+        ))
+    
+    # 레이아웃 설정 (모던 핀테크 스타일)
+    fig.update_layout(
+        title=dict(
+            text=f"{name} ({symbol}) 주가 차트",
+            font=dict(size=20, color='#ffffff', family='Pretendard'),
+            x=0.5,
+            xanchor='center'
+        ),
+        xaxis=dict(
+            title=dict(
+                text="날짜",
+                font=dict(color='#e5e7eb', size=14, family='Pretendard')
+            ),
+            tickfont=dict(color='#9ca3af', size=12),
+            gridcolor='rgba(128, 128, 128, 0.1)',  # 연한 회색 그리드
+            gridwidth=1,
+            showgrid=True,
+            zeroline=False,
+            linecolor='rgba(255, 255, 255, 0.1)',
+            linewidth=1
+        ),
+        yaxis=dict(
+            title=dict(
+                text="가격",
+                font=dict(color='#e5e7eb', size=14, family='Pretendard')
+            ),
+            tickfont=dict(color='#9ca3af', size=12),
+            gridcolor='rgba(128, 128, 128, 0.1)',  # 연한 회색 그리드
+            gridwidth=1,
+            showgrid=True,
+            zeroline=False,
+            linecolor='rgba(255, 255, 255, 0.1)',
+            linewidth=1
+        ),
+        xaxis_rangeslider_visible=False,
+        height=600,
+        hovermode='x unified',
+        dragmode='zoom',
+        plot_bgcolor='rgba(0, 0, 0, 0)',
+        paper_bgcolor='rgba(0, 0, 0, 0)',
+        font=dict(family='Pretendard', color='#e5e7eb'),
+        legend=dict(
+            bgcolor='rgba(0, 0, 0, 0)',
+            bordercolor='rgba(255, 255, 255, 0.1)',
+            borderwidth=1,
+            font=dict(color='#e5e7eb', size=12)
+        )
+    )
+    
+    return fig.to_json()
+
+# ==========================================
+# 주가 이력 일괄 받기 (청크 단위 병렬 + 진행 상황 저장)
+# ==========================================
+
+# 진행 상황 파일 읽기 (없거나 손상되었으면 None)
+def _read_backfill_checkpoint():
+    try:
+        with open(BACKFILL_CHECKPOINT_PATH, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+# 진행 상황 파일 쓰기 (임시 파일에 쓴 뒤 교체)
+def _write_backfill_checkpoint(checkpoint):
+    os.makedirs(DATA_DIR, exist_ok=True)
+    tmp_path = BACKFILL_CHECKPOINT_PATH + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, ensure_ascii=False)
+    os.replace(tmp_path, BACKFILL_CHECKPOINT_PATH)
+
+# 일괄 받기 대상 종목 (시트 또는 stocks.csv)
+def load_backfill_symbols(source):
+    if source == "stocks.csv":
+        symbols = pd.read_csv(STOCKS_CSV_PATH, encoding='utf-8-sig', dtype=str)['Symbol']
+    else:
+        symbols = get_stock_snapshot().stocks_df['Symbol']
+    return list(dict.fromkeys(symbol.strip() for symbol in symbols.dropna().astype(str) if symbol.strip()))
+
+class BackfillJob:
+    """
+    종목 목록의 일봉 이력을 BACKFILL_CHUNK_SIZE개씩 병렬로 받아 로컬 저장소에 채우는 백그라운드 작업 (프로세스당 하나).
+    청크가 끝날 때마다 진행 상황을 BACKFILL_CHECKPOINT_PATH에 저장하므로 프로세스가 중단되어도 이어서 받을 수 있고,
+    요청 과다(429)로 제공자가 차단되면 CIRCUIT_BREAKER_COOLDOWN만큼 쉬었다가 같은 종목부터 다시 시도합니다.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.thread = None
+        self.checkpoint = _read_backfill_checkpoint()
+        self.state = 'idle'
+        self.message = ''
+        self.run_started = time.monotonic()
+        # 실행 중에 중단된 작업이 있으면 자동으로 이어받기
+        if self.checkpoint is not None and self.checkpoint.get('state') == 'running':
+            self.resume()
+    
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+    
+    def remaining(self):
+        if self.checkpoint is None:
+            return []
+        finished = set(self.checkpoint['done']) | set(self.checkpoint['failed'])
+        return [symbol for symbol in self.checkpoint['symbols'] if symbol not in finished]
+    
+    def start(self, symbols):
+        """새 작업 시작 (이전 진행 상황은 버림). 이미 실행 중이면 False."""
+        with self.lock:
+            if self.is_running():
+                return False
+            self.checkpoint = {
+                'symbols': list(symbols), 'done': [], 'failed': {},
+                'rows': 0, 'elapsed': 0.0, 'state': 'running'
+            }
+            _write_backfill_checkpoint(self.checkpoint)
+            return self._start_thread()
+    
+    def resume(self):
+        """저장된 진행 상황에서 이어받기. 이어받을 종목이 없거나 실행 중이면 False."""
+        with self.lock:
+            if self.is_running() or not self.remaining():
+                return False
+            self.checkpoint['state'] = 'running'
+            return self._start_thread()
+    
+    def _start_thread(self):
+        self.state = 'running'
+        self.message = ''
+        self.run_started = time.monotonic()
+        self.thread = threading.Thread(target=self._run, name="ohlcv-backfill", daemon=True)
+        self.thread.start()
+        return True
+    
+    def stats(self):
+        """진행 상황과 처리량 (종목/초, 행/초)"""
+        with self.lock:
+            checkpoint = self.checkpoint or {'symbols': [], 'done': [], 'failed': {}, 'rows': 0, 'elapsed': 0.0}
+            elapsed = checkpoint['elapsed'] + (time.monotonic() - self.run_started if self.is_running() else 0.0)
+            finished = len(checkpoint['done']) + len(checkpoint['failed'])
+            return {
+                'state': self.state,
+                'message': self.message,
+                'total': len(checkpoint['symbols']),
+                'done': len(checkpoint['done']),
+                'failed': dict(checkpoint['failed']),
+                'rows': checkpoint['rows'],
+                'elapsed': elapsed,
+                'symbols_per_sec': finished / elapsed if elapsed > 0 else 0.0,
+                'rows_per_sec': checkpoint['rows'] / elapsed if elapsed > 0 else 0.0,
+            }
+    
+    # 한 종목 받기 - (추가된 행 수, 실패 사유 또는 None)
+    @staticmethod
+    def _backfill_symbol(symbol):
+        parsed = _parse_symbol(symbol)
+        if parsed is None or not parsed['clean_symbol']:
+            return 0, "not_found"
+        before = _count_ohlcv_rows(parsed['key'])
+        meta = _ensure_ohlcv_fresh(parsed)
+        if meta is None:
+            return 0, _read_fetch_failure(parsed['key']) or "fetch_error"
+        return _count_ohlcv_rows(parsed['key']) - before, None
+    
+    def _run(self):
+        try:
+            while True:
+                chunk = self.remaining()[:BACKFILL_CHUNK_SIZE]
+                if not chunk:
+                    break
+                
+                rate_limited = False
+                with ThreadPoolExecutor(max_workers=max(1, min(PRICE_FETCH_WORKERS, len(chunk)))) as executor:
+                    futures = {executor.submit(self._backfill_symbol, symbol): symbol for symbol in chunk}
+                    for future in as_completed(futures):
+                        symbol = futures[future]
+                        try:
+                            rows, reason = future.result()
+                        except Exception:
+                            rows, reason = 0, "fetch_error"
+                        with self.lock:
+                            if reason == "rate_limited":
+                                # 완료 처리하지 않고 쉬었다가 다시 시도
+                                rate_limited = True
+                            elif reason is None:
+                                self.checkpoint['done'].append(symbol)
+                                self.checkpoint['rows'] += rows
+                            else:
+                                self.checkpoint['failed'][symbol] = reason
+                
+                # 청크마다 진행 상황 저장
+                with self.lock:
+                    now = time.monotonic()
+                    self.checkpoint['elapsed'] += now - self.run_started
+                    self.run_started = now
+                    _write_backfill_checkpoint(self.checkpoint)
+                
+                if rate_limited:
+                    self.state = 'paused'
+                    self.message = f"요청 과다로 {CIRCUIT_BREAKER_COOLDOWN}초 대기 중"
+                    time.sleep(CIRCUIT_BREAKER_COOLDOWN)
+                    self.state = 'running'
+                    self.message = ''
+                    self.run_started = time.monotonic()
             
-            # 4. 데이터 표준화 (차트 호환성 유지)
-            # 인덱스 이름 'Date'로 통일
-            if df.index.name != 'Date':
-                df.index.name = 'Date'
+            with self.lock:
+                self.checkpoint['state'] = 'done'
+                _write_backfill_checkpoint(self.checkpoint)
+            self.state = 'done'
+        except Exception as e:
+            # 진행 상황 파일은 'running'으로 남아 다음 실행 때 이어받음
+            self.state = 'error'
+            self.message = str(e)
+
+# 주가 이력 일괄 받기 작업 (모든 세션 공유, 프로세스 시작 시 중단된 작업 이어받기)
+@st.cache_resource
+def get_backfill_job():
+    return BackfillJob()
+
+# ==========================================
+# 종목 스크리너 (여러 종목을 하나의 가격 행렬로 한 번에 계산)
+# ==========================================
+
+# 스크린 프리셋 (이름 -> 규칙 식)
+SCREEN_PRESETS = {
+    "주80": "ma_div(80, 10, 3)",
+    "52주 신고가": "breakout_high(52)",
+    "52주 신저가": "breakdown_low(52)",
+    "거래량 급증": "volume_spike(2, 20)",
+    "갭 상승": "gap_up(3)",
+    "갭 하락": "gap_down(3)",
+}
+
+class ScreenExpressionError(ValueError):
+    """스크린 식을 해석할 수 없음"""
+
+# 저장소에 이미 있는 데이터만으로 (저장 키, 데이터 버전) 목록 만들기 (갱신/네트워크 요청 없음)
+def _stored_key_versions(symbols):
+    symbol_keys = {}
+    for symbol in symbols:
+        parsed = _parse_symbol(symbol)
+        if parsed is not None:
+            symbol_keys[symbol] = parsed['key']
+    versions = _read_ohlcv_versions(set(symbol_keys.values()))
+    key_versions = tuple(sorted(versions.items()))
+    symbol_keys = {symbol: key for symbol, key in symbol_keys.items() if key in versions}
+    return key_versions, symbol_keys
+
+# 가격 행렬 (일봉/주봉 항목별 DataFrame, 열: 저장 키) - 종목별 데이터 버전이 바뀔 때만 다시 만듦 (읽기 전용, 모든 세션 공유)
+@st.cache_resource(max_entries=8)
+def _load_price_panel(key_versions):
+    daily = {}
+    weekly = {}
+    for key, version in key_versions:
+        frame = _load_ohlcv_frame(key, version)
+        weekly_frame = _load_weekly_frame(key, version)
+        if frame is not None:
+            daily[key] = frame
+        if weekly_frame is not None:
+            weekly[key] = weekly_frame
+    keys = list(daily)
+    
+    def wide(frames, column):
+        if not frames:
+            return _freeze_frame(pd.DataFrame(index=pd.DatetimeIndex([], name='Date'), columns=keys, dtype=float))
+        return _freeze_frame(pd.DataFrame({key: frame[column] for key, frame in frames.items()}).sort_index().reindex(columns=keys))
+    
+    return {
+        'daily': {column: wide(daily, column) for column in OHLCV_COLUMNS},
+        'weekly': {column: wide(weekly, column) for column in ['Open', 'High', 'Low', 'Close', 'MA20', 'MA80']},
+    }
+
+# 종목별 끝에서 start번째~stop번째 유효값 위치 (종목마다 마지막 거래일이 다를 수 있음)
+def _tail_mask(values, start, stop):
+    valid = ~np.isnan(values)
+    position_from_end = np.cumsum(valid[::-1], axis=0)[::-1]
+    return valid & (position_from_end >= start) & (position_from_end <= stop)
+
+# 마스크된 값만으로 열별 집계 (해당 값이 하나도 없으면 NaN)
+def _masked_reduce(values, mask, func):
+    with np.errstate(all='ignore'):
+        masked = np.where(mask, values, np.nan)
+        if func == 'sum':
+            return np.where(mask.any(axis=0), np.nansum(masked, axis=0), np.nan)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            return {'max': np.nanmax, 'min': np.nanmin, 'mean': np.nanmean}[func](masked, axis=0)
+
+# 열별 마지막 유효값
+def _last_values(values, offset=1):
+    return _masked_reduce(values, _tail_mask(values, offset, offset), 'sum')
+
+# 규칙: 주봉 이동평균선 이격 (최근 days 거래일 중 하루라도 |종가 - MA| / MA <= pct%)
+def _rule_ma_div(panel, window=80, pct=10, days=3):
+    stored_ma = panel['weekly'].get(f"MA{int(window)}")
+    if stored_ma is not None:
+        # 저장소에서 주봉과 함께 이어서 계산해 둔 이동평균 (차트와 같은 값)
+        ma = _last_values(stored_ma.to_numpy(dtype=float), 1)
+    else:
+        weekly_close = panel['weekly']['Close'].to_numpy(dtype=float)
+        window_mask = _tail_mask(weekly_close, 1, int(window))
+        enough = window_mask.sum(axis=0) >= int(window)
+        ma = np.where(enough, _masked_reduce(weekly_close, window_mask, 'sum') / int(window), np.nan)
+    
+    closes = panel['daily']['Close'].to_numpy(dtype=float)
+    recent = _tail_mask(closes, 1, int(days)) & (closes != 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        divergence = np.abs(closes - ma) / ma
+    return (recent & (divergence <= pct / 100) & np.isfinite(ma) & (ma != 0)).any(axis=0)
+
+# 규칙: 직전 weeks주 고가 돌파 (진행 중인 이번 주 제외)
+def _rule_breakout_high(panel, weeks=52):
+    weekly_high = panel['weekly']['High'].to_numpy(dtype=float)
+    previous_high = _masked_reduce(weekly_high, _tail_mask(weekly_high, 2, int(weeks) + 1), 'max')
+    with np.errstate(invalid='ignore'):
+        return _last_values(panel['daily']['Close'].to_numpy(dtype=float)) > previous_high
+
+# 규칙: 직전 weeks주 저가 이탈 (진행 중인 이번 주 제외)
+def _rule_breakdown_low(panel, weeks=52):
+    weekly_low = panel['weekly']['Low'].to_numpy(dtype=float)
+    previous_low = _masked_reduce(weekly_low, _tail_mask(weekly_low, 2, int(weeks) + 1), 'min')
+    with np.errstate(invalid='ignore'):
+        return _last_values(panel['daily']['Close'].to_numpy(dtype=float)) < previous_low
+
+# 규칙: 거래량 급증 (마지막 거래량 >= 직전 days일 평균 × mult)
+def _rule_volume_spike(panel, mult=2, days=20):
+    volume = panel['daily']['Volume'].to_numpy(dtype=float)
+    average = _masked_reduce(volume, _tail_mask(volume, 2, int(days) + 1), 'mean')
+    with np.errstate(invalid='ignore'):
+        return (_last_values(volume) >= average * mult) & (average > 0)
+
+# 규칙: 갭 상승 (마지막 시가 >= 전일 종가 × (1 + pct%))
+def _rule_gap_up(panel, pct=3):
+    last_open = _last_values(panel['daily']['Open'].to_numpy(dtype=float))
+    previous_close = _last_values(panel['daily']['Close'].to_numpy(dtype=float), 2)
+    with np.errstate(invalid='ignore'):
+        return (last_open >= previous_close * (1 + pct / 100)) & (previous_close > 0)
+
+# 규칙: 갭 하락 (마지막 시가 <= 전일 종가 × (1 - pct%))
+def _rule_gap_down(panel, pct=3):
+    last_open = _last_values(panel['daily']['Open'].to_numpy(dtype=float))
+    previous_close = _last_values(panel['daily']['Close'].to_numpy(dtype=float), 2)
+    with np.errstate(invalid='ignore'):
+        return (last_open <= previous_close * (1 - pct / 100)) & (previous_close > 0)
+
+# 스크린 규칙 등록표 (식에서 사용할 이름 -> 함수). 새 규칙은 panel과 숫자 인자를 받아 열별 bool 배열을 반환
+SCREEN_RULES = {
+    "ma_div": _rule_ma_div,
+    "breakout_high": _rule_breakout_high,
+    "breakdown_low": _rule_breakdown_low,
+    "volume_spike": _rule_volume_spike,
+    "gap_up": _rule_gap_up,
+    "gap_down": _rule_gap_down,
+}
+
+# 스크린 식을 평가 함수로 변환 (예: "ma_div(80, 10) and not gap_down(3)")
+@st.cache_resource(max_entries=64)
+def compile_screen(expr):
+    """
+    규칙 이름 호출(숫자 인자만 허용), and / or / not, 괄호로 이루어진 식을 panel -> 열별 bool 배열 함수로 변환합니다.
+    그 밖의 문법은 ScreenExpressionError.
+    """
+    try:
+        tree = ast.parse(expr.strip(), mode='eval')
+    except SyntaxError as e:
+        raise ScreenExpressionError(f"식을 해석할 수 없습니다: {expr}") from e
+    
+    def number(node):
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            return -number(node.operand)
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+            return node.value
+        raise ScreenExpressionError("규칙 인자는 숫자만 사용할 수 있습니다.")
+    
+    # 인자 개수/이름이 규칙 함수와 맞는지 미리 확인 (평가 중 TypeError 방지)
+    def check_arguments(name, rule, args, kwargs):
+        try:
+            inspect.signature(rule).bind(None, *args, **kwargs)
+        except TypeError as e:
+            raise ScreenExpressionError(f"{name} 규칙의 인자가 올바르지 않습니다: {e}") from e
+    
+    def build(node):
+        if isinstance(node, ast.BoolOp):
+            parts = [build(value) for value in node.values]
+            combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+            return lambda panel: combine.reduce([part(panel) for part in parts])
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            inner = build(node.operand)
+            return lambda panel: ~inner(panel)
+        if isinstance(node, ast.Name) and node.id in SCREEN_RULES:
+            rule = SCREEN_RULES[node.id]
+            check_arguments(node.id, rule, [], {})
+            return lambda panel: np.asarray(rule(panel), dtype=bool)
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in SCREEN_RULES:
+            rule = SCREEN_RULES[node.func.id]
+            if any(isinstance(arg, ast.Starred) for arg in node.args) or any(keyword.arg is None for keyword in node.keywords):
+                raise ScreenExpressionError("규칙 인자에 *, ** 는 사용할 수 없습니다.")
+            args = [number(arg) for arg in node.args]
+            kwargs = {keyword.arg: number(keyword.value) for keyword in node.keywords}
+            check_arguments(node.func.id, rule, args, kwargs)
+            return lambda panel: np.asarray(rule(panel, *args, **kwargs), dtype=bool)
+        names = ", ".join(SCREEN_RULES)
+        raise ScreenExpressionError(f"사용할 수 없는 식입니다. 사용 가능한 규칙: {names}")
+    
+    return build(tree.body)
+
+# 스크린 결과 (식, 종목별 데이터 버전이 같으면 재사용) - {저장 키: 통과 여부}
+@st.cache_data(max_entries=32)
+def _evaluate_screen(expr, key_versions):
+    panel = _load_price_panel(key_versions)
+    columns = panel['daily']['Close'].columns
+    if len(columns) == 0:
+        return {}
+    passed = compile_screen(expr)(panel)
+    return dict(zip(columns, passed.tolist()))
+
+# 스크린 식을 만족하는 종목 목록
+def screen_symbols(symbols, expr):
+    """
+    스크린 식(SCREEN_RULES 규칙 조합)을 만족하는 종목만 set으로 반환합니다. 식 오류는 ScreenExpressionError.
+    저장소에 있는 일봉만 읽고 갱신 요청은 하지 않습니다 (갱신은 백그라운드 미리 받기가 담당).
+    """
+    compile_screen(expr)  # 가격 데이터를 준비하기 전에 식 오류 확인
+    key_versions, symbol_keys = _stored_key_versions(symbols)
+    passed = _evaluate_screen(expr, key_versions)
+    return {symbol for symbol, key in symbol_keys.items() if passed.get(key, False)}
+
+# ==========================================
+# 종목 비교 (공통 구간으로 맞춘 종가 행렬 하나로 수익률/상관관계/상대강도 계산)
+# ==========================================
+
+# 비교용 행렬 계산 - 종목별 데이터 버전 또는 시작일이 바뀔 때만 다시 계산
+@st.cache_data(max_entries=16)
+def _comparison_matrices(key_versions, range_start):
+    close = _load_price_panel(key_versions)['daily']['Close']
+    if range_start is not None:
+        close = ohlcv_range_view(close, range_start)
+    # 휴장일이 다른 시장(한국/미국)은 직전 종가로 채운 뒤, 모든 종목에 값이 있는 날부터 사용
+    close = close.ffill().dropna(axis=1, how='all').dropna()
+    if close.empty:
+        return None
+    
+    rebased = close / close.iloc[0] * 100
+    returns = close.pct_change().iloc[1:]
+    # 상대강도: 비교 종목 동일 비중 평균 대비 (100보다 크면 평균보다 강함)
+    relative_strength = rebased.div(rebased.mean(axis=1), axis=0) * 100
+    return {
+        'rebased': rebased,
+        'correlation': returns.corr(),
+        'relative_strength': relative_strength,
+    }
+
+# 여러 종목 비교 행렬 가져오기
+def get_comparison_matrices(symbols, range_start=None):
+    """
+    종목들의 종가를 하나의 날짜 인덱스로 맞춘 뒤 다음 행렬을 반환합니다 (열: 저장 키). 데이터가 없으면 None.
+      - rebased: 구간 첫날 = 100으로 환산한 가격
+      - correlation: 일간 수익률 상관계수
+      - relative_strength: 비교 종목 평균 대비 상대강도 (100 기준)
+    {symbol: 저장 키}도 함께 반환합니다. 저장소에 있는 일봉만 읽고 갱신 요청은 하지 않습니다 (갱신은 백그라운드 미리 받기가 담당).
+    """
+    key_versions, symbol_keys = _stored_key_versions(symbols)
+    if not key_versions:
+        return None, symbol_keys
+    return _comparison_matrices(key_versions, range_start), symbol_keys
+
+# ==========================================
+# 일간 상승률 (로컬 저장소 종가로 일괄 계산)
+# ==========================================
+
+# 저장 키별 마지막 두 종가의 상승률(%) - 종목별 데이터 버전이 같으면 재사용
+@st.cache_data(max_entries=8)
+def _daily_change_by_key(key_versions):
+    closes = _load_price_panel(key_versions)['daily']['Close']
+    if closes.empty:
+        return {}
+    values = closes.to_numpy(dtype=float)
+    last_close = _last_values(values, 1)
+    prev_close = _last_values(values, 2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change_pct = (last_close - prev_close) / prev_close * 100
+    return {
+        key: float(pct)
+        for key, pct in zip(closes.columns, change_pct)
+        if np.isfinite(pct)
+    }
+
+# 여러 종목 당일 상승률 일괄 계산
+def get_daily_changes(symbols):
+    """
+    종목별 당일 상승률(%)을 {symbol: 상승률}로 반환합니다 (계산할 수 없는 종목은 빠짐).
+    저장소에 있는 종가만 읽고 갱신 요청은 하지 않습니다 (갱신은 백그라운드 미리 받기가 담당).
+    """
+    key_versions, symbol_keys = _stored_key_versions(symbols)
+    changes = _daily_change_by_key(key_versions)
+    return {symbol: changes[key] for symbol, key in symbol_keys.items() if key in changes}
+
+# 상승률순 정렬 (모든 세션 공유)
+@st.cache_data(max_entries=64)
+def rank_by_change(revision, symbols, local_changes, screen_expr="", _snapshot=None):
+    """
+    symbols를 상승률 내림차순으로 정렬한 [(symbol, 상승률 또는 None)]을 반환합니다.
+    local_changes((symbol, 상승률) 튜플)에 없는 종목은 revision 스냅샷의 ChangeRate 값을 사용하고,
+    상승률이 없는 종목은 맨 아래에 둡니다. 같은 상승률이면 입력 순서를 유지합니다.
+    (revision, 종목 목록, 계산된 상승률, 스크린 식)이 같으면 캐시된 결과를 재사용하므로 시트가 바뀌면 자동으로 다시 계산됩니다.
+    _snapshot은 revision에 해당하는 스냅샷입니다 (캐시 키에는 revision만 사용).
+    """
+    if not symbols:
+        return []
+    snapshot = _snapshot if _snapshot is not None and _snapshot.revision == revision else _load_stock_snapshot(revision)
+    positions = [snapshot.symbol_index.get(symbol) for symbol in symbols]
+    sheet_rates = pd.Series(
+        [snapshot.stocks_df.at[pos, 'ChangeRate'] if pos is not None and 'ChangeRate' in snapshot.stocks_df.columns else None for pos in positions],
+        index=list(symbols),
+        dtype=object
+    )
+    # 문자열(% 기호 포함)이면 숫자로 변환
+    sheet_rates = pd.to_numeric(sheet_rates.astype("string").str.strip().str.rstrip('%'), errors='coerce')
+    rates = pd.Series(dict(local_changes), dtype=float).reindex(sheet_rates.index).combine_first(sheet_rates)
+    ranked = rates.sort_values(ascending=False, na_position='last', kind='mergesort')
+    return [(symbol, None if pd.isna(pct) else float(pct)) for symbol, pct in ranked.items()]
+
+# 상승률을 시트의 ChangeRate 열에 기록
+def save_change_rates(changes):
+    """
+    {symbol: 상승률}을 시트의 ChangeRate 열에 batch_update 한 번으로 기록합니다.
+    목록에 있는 종목의 셀만 기록하므로 나머지 셀(Apps Script 등이 쓴 값)은 건드리지 않습니다.
+    시트의 행 배치가 현재 스냅샷과 다르면 기록하지 않고 False를 반환합니다.
+    """
+    sheet_df = get_stock_snapshot().sheet_df.copy()
+    if sheet_df.empty or not changes or 'Symbol' not in sheet_df.columns or 'ChangeRate' not in sheet_df.columns:
+        return False
+    
+    changes_by_key = {_sheet_cell_key(symbol): round(pct, 2) for symbol, pct in changes.items()}
+    snapshot_symbols = [_sheet_cell_key(s) for s in sheet_df['Symbol']]
+    # 기록할 행 (0부터 시작하는 행 위치, 상승률)
+    updates = [(pos, changes_by_key[sym]) for pos, sym in enumerate(snapshot_symbols) if sym in changes_by_key]
+    if not updates:
+        return False
+    columns = sheet_df.columns.tolist()
+    
+    def write(spreadsheet, worksheet):
+        # 다른 세션이나 Apps Script가 행을 추가/삭제했다면 행이 어긋나므로 기록하지 않음
+        live_symbols = [_sheet_cell_key(s) for s in worksheet.col_values(columns.index('Symbol') + 1)[1:]]
+        if live_symbols != snapshot_symbols:
+            return False
+        rate_col = columns.index('ChangeRate') + 1
+        worksheet.batch_update([
+            {'range': rowcol_to_a1(pos + 2, rate_col), 'values': [[rate]]}
+            for pos, rate in updates
+        ], value_input_option='USER_ENTERED')
+        return True
+    
+    if not with_stocks_worksheet(write):
+        return False
+    
+    # 로컬 저장소 갱신 (기록한 행만)
+    change_rates = sheet_df['ChangeRate'].astype(object)
+    for pos, rate in updates:
+        change_rates.iat[pos] = rate
+    sheet_df['ChangeRate'] = change_rates
+    _write_through_local_stocks(sheet_df)
+    return True
+
+# ==========================================
+# 실시간 시세 (여러 종목을 한 번의 요청으로 조회, 짧은 캐시)
+# ==========================================
+
+# KRX 전 종목 시세표 (FinanceDataReader 한 번 호출) - {6자리 코드: 시세}
+@st.cache_data(ttl=INTRADAY_QUOTE_TTL)
+def _load_krx_quotes():
+    listing = call_provider("fdr", fdr.StockListing, 'KRX')
+    price = pd.to_numeric(listing['Close'], errors='coerce')
+    ratio_col = next((col for col in ['ChagesRatio', 'ChangesRatio', 'ChangeRatio'] if col in listing.columns), None)
+    if ratio_col is not None:
+        change_pct = pd.to_numeric(listing[ratio_col], errors='coerce')
+    else:
+        changes = pd.to_numeric(listing['Changes'], errors='coerce')
+        change_pct = changes / (price - changes) * 100
+    quotes = pd.DataFrame({
+        'price': price,
+        'change_pct': change_pct,
+        'volume': pd.to_numeric(listing['Volume'], errors='coerce') if 'Volume' in listing.columns else np.nan,
+    })
+    quotes.index = listing['Code'].astype(str).str.zfill(6)
+    quotes = quotes[~quotes.index.duplicated(keep='first')]
+    return quotes.to_dict('index')
+
+# yfinance 여러 종목 시세 (download 한 번 호출) - {요청 심볼: 시세}
+@st.cache_data(ttl=INTRADAY_QUOTE_TTL)
+def _load_yf_quotes(fetch_symbols):
+    data = call_provider(
+        "yfinance", yf.download, list(fetch_symbols),
+        period="5d", interval="1d", group_by="column", progress=False, threads=False
+    )
+    if data is None or data.empty:
+        return {}
+    close = data['Close']
+    volume = data['Volume']
+    if isinstance(close, pd.Series):
+        close = close.to_frame(fetch_symbols[0])
+        volume = volume.to_frame(fetch_symbols[0])
+    
+    # 종목별 마지막 두 종가 (진행 중인 오늘 봉이 있으면 현재가)
+    values = close.to_numpy(dtype=float)
+    last_price = _last_values(values, 1)
+    prev_close = _last_values(values, 2)
+    last_volume = _last_values(volume.reindex(columns=close.columns).to_numpy(dtype=float), 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change_pct = (last_price - prev_close) / prev_close * 100
+    return {
+        str(symbol): {'price': price, 'change_pct': pct, 'volume': vol}
+        for symbol, price, pct, vol in zip(close.columns, last_price, change_pct, last_volume)
+        if np.isfinite(price)
+    }
+
+# yfinance 시세 조회에 사용할 심볼 (한국 종목은 저장된 조회 경로의 접미사 사용)
+def _quote_fetch_symbol(parsed):
+    if not parsed['is_korean']:
+        return parsed['symbol_str']
+    resolved = _read_symbol_resolution(parsed['key'])
+    if resolved is not None and resolved[0] == "yfinance":
+        return resolved[1]
+    return parsed['clean_symbol'] + (parsed['market_suffix'] or '.KS')
+
+# 여러 종목 실시간 시세 일괄 조회
+def get_intraday_quotes(symbols):
+    """
+    종목별 최신 시세를 {symbol: {'price', 'change_pct', 'volume'}}로 반환합니다.
+    한국 종목은 KRX 시세표 한 번, 그 외(및 시세표에 없는 종목)는 yfinance download 한 번으로 조회하며,
+    결과는 INTRADAY_QUOTE_TTL 동안 모든 세션이 공유합니다. 조회할 수 없는 종목은 빠집니다.
+    """
+    quotes = {}
+    yf_targets = {}
+    krx_quotes = None
+    for symbol in dict.fromkeys(symbols):
+        parsed = _parse_symbol(symbol)
+        if parsed is None or not parsed['clean_symbol']:
+            continue
+        if parsed['is_korean'] and FDR_AVAILABLE:
+            if krx_quotes is None:
+                try:
+                    krx_quotes = _load_krx_quotes()
+                except Exception:
+                    krx_quotes = {}
+            quote = krx_quotes.get(parsed['clean_symbol'])
+            if quote is not None and pd.notna(quote.get('price')):
+                quotes[symbol] = quote
+                continue
+        yf_targets[symbol] = _quote_fetch_symbol(parsed)
+    
+    if yf_targets:
+        try:
+            yf_quotes = _load_yf_quotes(tuple(sorted(set(yf_targets.values()))))
+        except Exception:
+            yf_quotes = {}
+        for symbol, fetch_symbol in yf_targets.items():
+            if fetch_symbol in yf_quotes:
+                quotes[symbol] = yf_quotes[fetch_symbol]
+    return quotes
+
+# ==========================================
+# 시장 전체 스크리너 (KRX 전 종목 일봉 저장소 + 스크린 규칙 일괄 적용)
+# ==========================================
+
+# 저장소 파일 경로 (항목별 wide DataFrame: 행 날짜, 열 6자리 코드)
+def _universe_path(name):
+    return os.path.join(UNIVERSE_DIR, f"{name}.pkl")
+
+# 파일을 임시 파일에 쓴 뒤 교체 (읽는 쪽이 반쯤 쓰인 파일을 보지 않도록)
+def _write_universe_file(name, obj):
+    os.makedirs(UNIVERSE_DIR, exist_ok=True)
+    path = _universe_path(name)
+    tmp_path = path + ".tmp"
+    pd.to_pickle(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+# 시장 이름 정규화 (예: "KOSDAQ GLOBAL" → "KOSDAQ") - UNIVERSE_MARKETS와 비교하기 위함
+def _normalize_market(market):
+    name = str(market).strip().upper()
+    for base in UNIVERSE_MARKETS:
+        if name.startswith(base):
+            return base
+    return name
+
+# KRX 종목 목록 저장 (코드, 종목명, 시장)
+def _write_universe_listing(listing):
+    columns = [col for col in ['Code', 'Name', 'Market'] if col in listing.columns]
+    if 'Code' not in columns:
+        return
+    table = listing[columns].copy()
+    table['Code'] = table['Code'].astype(str).str.zfill(6)
+    if 'Market' in table.columns:
+        table['Market'] = table['Market'].map(_normalize_market)
+    try:
+        _write_universe_file("listing", table.drop_duplicates('Code').set_index('Code'))
+    except OSError:
+        pass
+
+# 저장된 항목별 일봉 행렬 읽기 (없으면 빈 dict)
+def _read_universe_frames():
+    frames = {}
+    for column in OHLCV_COLUMNS:
+        path = _universe_path(column)
+        if os.path.exists(path):
+            frames[column] = pd.read_pickle(path)
+    return frames
+
+# 저장소 버전 (종가 파일 수정 시각) - 없으면 None
+def get_universe_version():
+    path = _universe_path("Close")
+    return os.path.getmtime(path) if os.path.exists(path) else None
+
+# 받은 일봉을 기존 행렬에 병합해서 저장 (새 값 우선, 보관 기간 이전 행은 제거)
+def _save_universe_frames(existing, fetched, cutoff):
+    merged = {}
+    for column in OHLCV_COLUMNS:
+        new_frame = pd.DataFrame({
+            code: df[column] for code, df in fetched.items() if column in df.columns
+        })
+        old_frame = existing.get(column)
+        frame = new_frame if old_frame is None else new_frame.combine_first(old_frame)
+        frame = frame[frame.index >= cutoff].sort_index()
+        merged[column] = frame.astype(float)
+    # 종가를 마지막에 저장 (종가 파일 수정 시각이 저장소 버전)
+    for column in sorted(merged, key=lambda col: col == 'Close'):
+        _write_universe_file(column, merged[column])
+    return merged
+
+class UniverseRefreshJob:
+    """
+    KRX 전 종목 일봉 저장소를 백그라운드에서 갱신하는 작업 (프로세스당 하나).
+    저장소에 없는 종목은 보관 기간 전체를, 있는 종목은 마지막 저장일 근처부터만 받고,
+    마지막 KRX 장 마감일까지 이미 저장된 종목은 요청하지 않습니다.
+    UNIVERSE_SAVE_EVERY 종목마다 중간 저장하므로 중단되어도 받은 만큼은 남습니다.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.thread = None
+        self.status = {'state': 'idle', 'done': 0, 'total': 0, 'failed': 0, 'message': ''}
+    
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+    
+    def start(self):
+        with self.lock:
+            if self.is_running():
+                return False
+            self.status = {'state': 'running', 'done': 0, 'total': 0, 'failed': 0, 'message': '종목 목록 조회 중'}
+            self.thread = threading.Thread(target=self._run, name="universe-refresh", daemon=True)
+            self.thread.start()
+            return True
+    
+    def _update(self, **values):
+        with self.lock:
+            self.status.update(values)
+    
+    def _run(self):
+        try:
+            listing = call_provider("fdr", fdr.StockListing, 'KRX')
+            # 종목 목록은 갱신 작업에서만 저장 (시장 이름 정규화 포함)
+            _write_universe_listing(listing)
+            markets = listing['Market'].map(_normalize_market)
+            codes = listing.loc[markets.isin(UNIVERSE_MARKETS), 'Code'].astype(str).str.zfill(6).unique().tolist()
             
-            # 타임존 제거 (yfinance는 타임존이 있고, fdr은 없을 수 있음)
-            if df.index.tz is not None:
-                df.index = df.index.tz_localize(None)
+            existing = _read_universe_frames()
+            cutoff = pd.Timestamp.now().normalize() - pd.Timedelta(days=UNIVERSE_HISTORY_DAYS)
+            existing_close = existing.get('Close')
+            last_dates = existing_close.apply(pd.Series.last_valid_index) if existing_close is not None else pd.Series(dtype=object)
+            # 마지막으로 확정된 KRX 장 마감일 (이 날짜까지 저장된 종목은 받을 것이 없음)
+            last_session = _last_market_close("KRX").tz_localize(None).normalize()
             
-            # 날짜 정규화 (시간 제거)
-            df.index = pd.to_datetime(df.index).normalize()
+            def start_of(code):
+                last_date = last_dates.get(code)
+                if last_date is None or pd.isna(last_date):
+                    return cutoff
+                return max(cutoff, last_date - pd.Timedelta(days=OHLCV_OVERLAP_DAYS))
             
-            # 컬럼명 표준화 (대소문자 통일: Open, High, Low, Close, Volume)
-            if not df.empty:
-                column_mapping = {}
-                for col in df.columns:
-                    col_lower = str(col).lower()
-                    if col_lower in ['open', '시가']:
-                        column_mapping[col] = 'Open'
-                    elif col_lower in ['high', '고가']:
-                        column_mapping[col] = 'High'
-                    elif col_lower in ['low', '저가']:
-                        column_mapping[col] = 'Low'
-                    elif col_lower in ['close', '종가']:
-                        column_mapping[col] = 'Close'
-                    elif col_lower in ['volume', '거래량']:
-                        column_mapping[col] = 'Volume'
-                
-                if column_mapping:
-                    df = df.rename(columns=column_mapping)
+            def is_current(code):
+                last_date = last_dates.get(code)
+                return last_date is not None and not pd.isna(last_date) and last_date >= last_session
             
-            return df
+            codes = [code for code in codes if not is_current(code)]
             
+            self._update(total=len(codes), message='일봉 받는 중')
+            fetched = {}
+            with ThreadPoolExecutor(max_workers=PRICE_FETCH_WORKERS) as executor:
+                futures = {
+                    executor.submit(call_provider, "fdr", fdr.DataReader, code, start_of(code).strftime("%Y-%m-%d")): code
+                    for code in codes
+                }
+                for future in as_completed(futures):
+                    code = futures[future]
+                    try:
+                        df = future.result()
+                        if df is not None and not df.empty:
+                            fetched[code] = _standardize_ohlcv(df)
+                    except Exception:
+                        self._update(failed=self.status['failed'] + 1)
+                    self._update(done=self.status['done'] + 1)
+                    # 중간 저장 (중단되어도 받은 종목은 남김)
+                    if len(fetched) >= UNIVERSE_SAVE_EVERY:
+                        existing = _save_universe_frames(existing, fetched, cutoff)
+                        fetched = {}
+            if fetched:
+                _save_universe_frames(existing, fetched, cutoff)
+            self._update(state='done', message='완료')
         except Exception as e:
-            error_msg = str(e).lower()
-            
-            # Rate limiting 오류 감지
-            if "too many requests" in error_msg or "rate limit" in error_msg or "429" in error_msg:
-                if attempt < max_retries - 1:
-                    wait_time = retry_delay * (2 ** attempt)  # 지수 백오프
-                    # 오류 메시지 숨김 (조용히 재시도)
-                    time.sleep(wait_time)
-                    continue
-                else:
-                    # 최종 실패 시에도 오류 메시지 숨김
-                    return None
-            
-            # 기타 오류
-            if attempt < max_retries - 1:
-                time.sleep(retry_delay)
-                continue
-            else:
-                # 오류 메시지 숨김
-                return None
-    
-    return None
+            self._update(state='error', message=str(e))
 
-# 당일 상승률 계산 함수
-@st.cache_data(ttl=300)  # 5분 캐싱
-def get_daily_change(symbol):
-    """당일 상승률을 계산합니다."""
-    try:
-        # API 요청 전 지연 (rate limit 방지)
-        time.sleep(1.0)  # 1초로 증가
-        
-        stock_df = get_stock_data(symbol)
-        if stock_df is None or stock_df.empty:
-            return None
-        
-        # 최신 데이터 2개 (당일, 전일)
-        if len(stock_df) < 2:
-            return None
-        
-        latest = stock_df.iloc[-1]
-        previous = stock_df.iloc[-2]
-        
-        if 'Close' not in latest or 'Close' not in previous:
-            return None
-        
-        prev_close = previous['Close']
-        curr_close = latest['Close']
-        
-        if pd.isna(prev_close) or pd.isna(curr_close) or prev_close == 0:
-            return None
-        
-        change_pct = ((curr_close - prev_close) / prev_close) * 100
-        return change_pct
-    except Exception as e:
+# 시장 스크리너 갱신 작업 (모든 세션 공유)
+@st.cache_resource
+def get_universe_job():
+    return UniverseRefreshJob()
+
+# 시장 전체 가격 행렬 (저장소 버전별로 한 번만 읽고 모든 세션이 공유 - 읽기 전용)
+@st.cache_resource(max_entries=1)
+def _load_universe_panel(version):
+    daily = _read_universe_frames()
+    if 'Close' not in daily:
         return None
+    columns = daily['Close'].columns
+    daily = {column: frame.reindex(columns=columns) for column, frame in daily.items()}
+    # 주봉(W-FRI)은 전 종목을 한 번에 리샘플링
+    weekly = {
+        'Open': daily['Open'].resample('W-FRI').first(),
+        'High': daily['High'].resample('W-FRI').max(),
+        'Low': daily['Low'].resample('W-FRI').min(),
+        'Close': daily['Close'].resample('W-FRI').last(),
+    }
+    listing_path = _universe_path("listing")
+    listing = pd.read_pickle(listing_path) if os.path.exists(listing_path) else pd.DataFrame()
+    return {'daily': daily, 'weekly': weekly, 'listing': listing}
 
-# 주80 이동평균선 조건 체크 함수
-@st.cache_data(ttl=3600)  # 1시간 캐싱
-def check_week80_condition(symbol):
+# 시장 전체 스캔 (저장소 버전과 식이 같으면 재사용)
+@st.cache_data(max_entries=16)
+def scan_universe(expr, version, markets=tuple(UNIVERSE_MARKETS)):
     """
-    주80 이동평균선과 종가의 이격이 10% 이하인지 확인합니다.
-    (최근 3일 중 하루라도 조건을 만족하면 True)
+    저장된 KRX 전 종목 일봉에 스크린 식을 한 번에 적용하여 조건을 만족하는 종목 표를 반환합니다.
+    (코드, 종목명, 시장, 종가, 상승률) - 저장소가 없으면 빈 표. 식 오류는 ScreenExpressionError.
     """
-    try:
-        # 일봉 데이터 가져오기 (충분한 기간 확보)
-        df = get_stock_data(symbol)
-        if df is None or df.empty:
-            return False
-            
-        # 주봉으로 리샘플링하여 80주 이동평균선 계산
-        weekly_df = df.resample('W').last()
-        if len(weekly_df) < 80:
-            return False
-            
-        weekly_df['MA80'] = weekly_df['Close'].rolling(window=80).mean()
-        
-        # 최신 MA80 값 구하기 (유효한 마지막 값)
-        ma80 = weekly_df['MA80'].dropna().iloc[-1]
-        
-        if pd.isna(ma80) or ma80 == 0:
-            return False
-            
-        # 최근 3일 일봉 종가와 비교
-        # 최근 3일 데이터 가져오기
-        recent_days = df.iloc[-3:]
-        
-        for _, row in recent_days.iterrows():
-            close_price = row['Close']
-            if pd.isna(close_price) or close_price == 0:
-                continue
-                
-            # 이격도 계산: |종가 - MA80| / MA80
-            divergence = abs(close_price - ma80) / ma80
-            
-            # 이격도가 10% 이하이면 True 반환
-            if divergence <= 0.1:
-                return True
-                
-        return False
-    except Exception as e:
-        # 에러 발생 시 False 처리 (로그는 생략하여 사용자 화면 오염 방지)
-        return False
+    columns = ['Code', 'Name', 'Market', 'Close', 'ChangePct']
+    panel = _load_universe_panel(version)
+    if panel is None:
+        return pd.DataFrame(columns=columns)
+    
+    passed = compile_screen(expr)(panel)
+    closes = panel['daily']['Close']
+    values = closes.to_numpy(dtype=float)
+    last_close = _last_values(values, 1)
+    prev_close = _last_values(values, 2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change_pct = (last_close - prev_close) / prev_close * 100
+    
+    hits = pd.DataFrame({
+        'Code': closes.columns,
+        'Close': last_close,
+        'ChangePct': change_pct,
+    })[passed]
+    listing = panel['listing']
+    hits['Name'] = hits['Code'].map(listing['Name']) if 'Name' in listing.columns else ""
+    hits['Market'] = hits['Code'].map(listing['Market']).map(_normalize_market) if 'Market' in listing.columns else ""
+    if 'Market' in listing.columns:
+        hits = hits[hits['Market'].isin(markets)]
+    return hits[columns].sort_values('ChangePct', ascending=False, na_position='last').reset_index(drop=True)
 
 # ==========================================
 # 분할 매수 플래너 관련 함수들
 # ==========================================
 
-# 분할 매수 플래너 데이터 로드 (통합 시트 사용)
-@st.cache_data(ttl=60)
-def load_split_purchase_data():
-    """통합 Stocks 시트에서 분할 매수 플래너 데이터를 로드합니다."""
-    try:
-        client = get_google_sheets_client()
-        spreadsheet = client.open(SPREADSHEET_NAME)
-        
-        try:
-            ws = spreadsheet.worksheet("Stocks")
-            records = ws.get_all_records()
-            
-            if not records:
-                return pd.DataFrame(columns=["Symbol", "Name", "InterestDate", "Note", "MarketCap", "Installments", "Category", "BuyTransactions", "SellTransactions"])
-            
-            df = pd.DataFrame(records)
-            
-            # MarketCap이나 Installments가 있는 종목만 필터링 (분할 매수 플래너용)
-            # 또는 모든 데이터 반환 (필터링은 UI에서 처리)
-            return df
-        except gspread.WorksheetNotFound:
-            # 워크시트가 없으면 생성 (init_google_sheet에서 처리되지만 안전장치)
-            ws = spreadsheet.add_worksheet(title="Stocks", rows=1000, cols=20)
-            headers = ["Symbol", "Name", "InterestDate", "Note", "MarketCap", "Installments", "Category", "BuyTransactions", "SellTransactions"]
-            ws.append_row(headers)
-            return pd.DataFrame(columns=headers)
-    except Exception as e:
-        st.error(f"❌ 분할 매수 데이터 로드 실패: {str(e)}")
-        return pd.DataFrame(columns=["Symbol", "Name", "InterestDate", "Note", "MarketCap", "Installments", "Category", "BuyTransactions", "SellTransactions"])
-
 # 분할 매수 플래너 데이터 저장 (통합 시트 사용)
 def save_split_purchase_data(df):
-    """통합 Stocks 시트에 분할 매수 플래너 데이터를 저장합니다."""
+    """
+    통합 Stocks 시트에 분할 매수 플래너 데이터를 저장합니다. 저장했으면 True.
+    다른 곳에서 시트 행이 추가/삭제되었으면 덮어쓰지 않고 False를 반환합니다 (경고는 다음 화면에 표시).
+    """
     try:
-        client = get_google_sheets_client()
-        spreadsheet = client.open(SPREADSHEET_NAME)
-        ws = spreadsheet.worksheet("Stocks")
-        
-        # 전체 데이터 로드
+        # 전체 데이터 로드 (diff 비교용 스냅샷 보관)
         all_df = load_stocks()
-        
+        existing_df = all_df.copy()
+
         # 기존 ChangeRate 값 보존 (Symbol 기준)
         # Apps Script가 업데이트한 최신 ChangeRate 값을 유지하기 위해
         change_rate_map = {}
@@ -1233,10 +3327,17 @@ def save_split_purchase_data(df):
         # 기존 데이터 백업 (복원용)
         backup_df = all_df.copy()
         
-        # 전체 데이터 저장 (안전하게)
+        # 변경된 셀/행만 저장, diff 적용이 불가능하면 전체 데이터 저장 (안전하게)
+        def write(spreadsheet, ws):
+            if not _write_stocks_delta(ws, existing_df, all_df):
+                ws.clear()
+                ws.update(values, value_input_option='USER_ENTERED')
+        
         try:
-            ws.clear()
-            ws.update(values, value_input_option='USER_ENTERED')
+            with_stocks_worksheet(write)
+        except SheetLayoutChangedError:
+            _handle_sheet_layout_changed()
+            return False
         except Exception as update_error:
             # 업데이트 실패 시 기존 데이터 복원 시도
             st.error(f"❌ 데이터 저장 중 오류 발생: {str(update_error)}")
@@ -1244,23 +3345,73 @@ def save_split_purchase_data(df):
             if not backup_df.empty:
                 try:
                     restore_values = [backup_df.columns.tolist()] + backup_df.fillna("").values.tolist()
-                    ws.clear()
-                    ws.update(restore_values, value_input_option='USER_ENTERED')
+                    def restore(spreadsheet, ws):
+                        ws.clear()
+                        ws.update(restore_values, value_input_option='USER_ENTERED')
+                    with_stocks_worksheet(restore)
                     st.info("기존 데이터로 복원을 시도했습니다.")
                 except:
                     pass
             raise
         
-        # 캐시 무효화
-        load_stocks.clear()
-        load_split_purchase_data.clear()
+        # 로컬 저장소 갱신
+        _write_through_local_stocks(all_df)
+        return True
     except Exception as e:
         st.error(f"❌ 분할 매수 데이터 저장 실패: {str(e)}")
         raise
 
-# 초기화
+# 초기화 (프로세스당 한 번만 시트를 열고 헤더 확인, 이후 rerun은 캐시된 핸들 재사용)
 init_google_sheet()
 
+# 현재 rerun에서 모든 화면이 공유할 종목 스냅샷 (한 번만 로드)
+stock_snapshot = get_stock_snapshot()
+
+# 직전 저장이 시트 행 배치 변경으로 취소되었으면 경고 표시
+if "save_warning" in st.session_state:
+    st.warning(st.session_state.pop("save_warning"))
+
+# 시트 종목 주가 미리 받기 (프로세스당 한 번만 시작)
+start_price_prefetch()
+
+# 관심종목 추가 (새 종목 추가 폼과 시장 스크리너에서 공용)
+def add_interest_stocks(entries):
+    """
+    entries: [(symbol, name, interest_date, note)] - 이미 등록된 종목(대소문자/공백 무시)은 건너뜁니다.
+    새 종목은 한 번의 저장으로 추가하고 (추가된 Symbol 목록, 중복 Symbol 목록)을 반환합니다.
+    """
+    df = load_stocks()
+    
+    # 중복 체크: 대소문자 무시, 공백 제거 비교
+    existing_symbols = set(df['Symbol'].astype(str).str.strip().str.upper())
+    new_rows = []
+    added = []
+    duplicates = []
+    for symbol, name, interest_date, note in entries:
+        symbol_normalized = str(symbol).strip().upper()
+        if symbol_normalized in existing_symbols:
+            duplicates.append(symbol_normalized)
+            continue
+        existing_symbols.add(symbol_normalized)
+        new_rows.append({
+            "Symbol": symbol_normalized,
+            "Name": name,
+            "InterestDate": interest_date.strftime("%Y-%m-%d") if interest_date else "",
+            "Note": note if note else "",
+            "MarketCap": "",  # 관심종목이므로 비워둠
+            "Installments": "",  # 관심종목이므로 비워둠
+            "Category": "",  # 관심종목이므로 비워둠
+            "BuyTransactions": "[]",
+            "SellTransactions": "[]"
+        })
+        added.append(symbol_normalized)
+    
+    if new_rows:
+        df = pd.concat([df, pd.DataFrame(new_rows)], ignore_index=True)
+        if not save_stocks(df):
+            return [], duplicates
+    return added, duplicates
+
 # 새 종목 추가 콜백 함수
 def add_stock_callback():
     """새 종목 추가 폼 제출 시 실행되는 콜백 함수"""
@@ -1271,30 +3422,13 @@ def add_stock_callback():
     note = st.session_state.get("note_input", "")
     
     if symbol and name:
-        df = load_stocks()
+        added, duplicates = add_interest_stocks([(symbol, name, interest_date, note)])
         
-        # 중복 체크: 대소문자 무시, 공백 제거 비교
-        symbol_normalized = symbol.strip().upper()
-        existing_symbols = df['Symbol'].astype(str).str.strip().str.upper()
-        
-        if symbol_normalized in existing_symbols.values:
+        if duplicates:
             st.session_state["add_result"] = {"type": "error", "message": "이미 등록된 종목입니다."}
+        elif not added:
+            st.session_state["add_result"] = {"type": "error", "message": "저장하지 못했습니다. 새로고침 후 다시 시도해주세요."}
         else:
-            new_row = {
-                "Symbol": symbol_normalized,
-                "Name": name,
-                "InterestDate": interest_date.strftime("%Y-%m-%d") if interest_date else "",
-                "Note": note if note else "",
-                "MarketCap": "",  # 관심종목이므로 비워둠
-                "Installments": "",  # 관심종목이므로 비워둠
-                "Category": "",  # 관심종목이므로 비워둠
-                "BuyTransactions": "[]",
-                "SellTransactions": "[]"
-            }
-            
-            df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-            save_stocks(df)
-            
             # 성공 시 입력값 초기화
             st.session_state["symbol_input"] = ""
             st.session_state["name_input"] = ""
@@ -1335,35 +3469,64 @@ with st.sidebar:
     
     # 종목 삭제
     st.subheader("종목 삭제하기")
-    df = load_stocks()
+    df = stock_snapshot.stocks_df
     if not df.empty:
-        delete_options = [f"{row['Name']} ({row['Symbol']})" for _, row in df.iterrows()]
-        # 가나다순 정렬
-        delete_options = sorted(delete_options)
-        selected_delete = st.selectbox("삭제할 종목 선택", delete_options, key="delete_select")
-        
-        if st.button("삭제", key="delete_button"):
-            # 정렬된 리스트에서 선택된 항목의 Symbol 추출
-            # 형식: "Name (Symbol)"
-            selected_symbol = selected_delete.split("(")[1].rstrip(")")
+        # 가나다순 정렬 (선택 값은 Symbol, 화면에는 "Name (Symbol)" 표시)
+        delete_options = stock_snapshot.sorted_symbols()
+        selected_symbol = st.selectbox("삭제할 종목 선택", delete_options, format_func=stock_snapshot.label_of, key="delete_select")
+        
+        if st.button("삭제", key="delete_button") and selected_symbol in stock_snapshot.symbol_index:
             # 원본 df에서 해당 Symbol로 찾기
             mask = df['Symbol'] == selected_symbol
-            deleted_name = df.loc[mask, 'Name'].values[0] if mask.any() else selected_delete.split("(")[0].strip()
+            deleted_name = df.at[stock_snapshot.symbol_index[selected_symbol], 'Name']
             df = df[~mask].reset_index(drop=True)
             save_stocks(df)
             st.success(f"{deleted_name} 종목이 삭제되었습니다!")
             st.rerun()
     else:
         st.info("저장된 종목이 없습니다.")
+    
+    st.divider()
+    
+    # 주가 이력 일괄 받기 (백그라운드)
+    st.subheader("주가 이력 일괄 받기")
+    backfill_job = get_backfill_job()
+    backfill_source = st.radio("대상", options=["시트 종목", "stocks.csv"], horizontal=True, key="backfill_source")
+    col_backfill1, col_backfill2 = st.columns(2)
+    with col_backfill1:
+        if st.button("시작", key="backfill_start", disabled=backfill_job.is_running(), use_container_width=True):
+            try:
+                backfill_job.start(load_backfill_symbols(backfill_source))
+            except Exception as e:
+                st.error(f"❌ 종목 목록을 읽을 수 없습니다: {str(e)}")
+    with col_backfill2:
+        if st.button("이어하기", key="backfill_resume", disabled=backfill_job.is_running() or not backfill_job.remaining(), use_container_width=True):
+            backfill_job.resume()
+    
+    backfill_stats = backfill_job.stats()
+    if backfill_stats['total'] > 0:
+        backfill_finished = backfill_stats['done'] + len(backfill_stats['failed'])
+        st.progress(
+            min(1.0, backfill_finished / backfill_stats['total']),
+            text=f"{backfill_finished}/{backfill_stats['total']} 종목 (실패 {len(backfill_stats['failed'])})"
+        )
+        st.caption(
+            f"{backfill_stats['symbols_per_sec']:.2f} 종목/초 · {backfill_stats['rows_per_sec']:,.0f} 행/초 · "
+            f"{backfill_stats['rows']:,}행 추가"
+            + (f" · {backfill_stats['message']}" if backfill_stats['message'] else "")
+        )
+        if backfill_stats['failed']:
+            with st.expander("실패한 종목"):
+                st.write(", ".join(f"{symbol} ({reason})" for symbol, reason in backfill_stats['failed'].items()))
 
 # 메인 화면 - 탭 구조
-tab1, tab2 = st.tabs(["📈 주식 추적기", "💰 분할 매수 플래너"])
+tab1, tab2, tab3 = st.tabs(["📈 주식 추적기", "💰 분할 매수 플래너", "🌐 시장 스크리너"])
 
 # 탭 1: 주식 추적기
 with tab1:
     st.title("📈 나만의 주식 추적기")
     
-    df = load_stocks()
+    df = stock_snapshot.stocks_df
 
     if df.empty:
         st.info("사이드바에서 종목을 추가해주세요.")
@@ -1401,21 +3564,27 @@ with tab1:
                 st.write("옵션")
                 col_opt1, col_opt2 = st.columns(2)
                 with col_opt1:
-                    prev_sort_state = st.session_state.get("sort_by_change", False)
                     sort_by_change = st.checkbox("상승률순", key="sort_by_change", value=False)
+                    # 실시간 시세로 정렬 (INTRADAY_QUOTE_TTL마다 일괄 조회)
+                    use_intraday_quotes = sort_by_change and st.checkbox("실시간 시세", key="intraday_quotes", help="장중 현재가 기준 상승률로 정렬합니다.")
+                    # 계산한 상승률을 시트 ChangeRate 열에 기록 (선택)
+                    write_change_rates = sort_by_change and st.button("📝 시트에 기록", key="write_change_rates", help="저장된 종가로 계산한 상승률을 시트의 ChangeRate 열에 기록합니다.")
                 with col_opt2:
-                    prev_week80_state = st.session_state.get("week80_check", False)
                     week80_check = st.checkbox("주80", key="week80_check", value=False)
                 
-                # 체크박스 상태가 변경되면 캐시 초기화
-                if prev_sort_state != sort_by_change or prev_week80_state != week80_check:
-                    # 관련 캐시 키들 제거
-                    keys_to_remove = [k for k in st.session_state.keys() if k.startswith("interest_stocks_change_")]
-                    for key in keys_to_remove:
-                        if key in st.session_state:
-                            del st.session_state[key]
-                    if 'interest_stocks_cache_symbols' in st.session_state:
-                        del st.session_state['interest_stocks_cache_symbols']
+                # 추가 스크린 (프리셋 또는 직접 입력한 규칙 식)
+                screen_preset = st.selectbox(
+                    "스크린",
+                    options=["없음"] + [name for name in SCREEN_PRESETS if name != "주80"] + ["직접 입력"],
+                    key="screen_preset"
+                )
+                if screen_preset == "직접 입력":
+                    st.text_input(
+                        "스크린 식",
+                        key="screen_expr",
+                        placeholder="예: ma_div(20, 5) and volume_spike(2, 20)",
+                        help="사용 가능한 규칙: " + ", ".join(SCREEN_RULES) + " (and / or / not, 괄호 사용 가능)"
+                    )
                 
                 strategy = "전체"
             else:
@@ -1424,67 +3593,52 @@ with tab1:
                     st.session_state['prev_category'] = category
         
         with col3:
-            # 종목 선택
-            stock_options = [f"{row['Name']} ({row['Symbol']})" for _, row in df.iterrows()]
+            # 종목 선택 (선택 값은 Symbol, 스냅샷에서 미리 계산한 파생 컬럼 사용)
+            derived = stock_snapshot.derived
+            stock_options = stock_snapshot.sorted_symbols()
+            # 상승률순일 때 Symbol별 표시 문자열 (없으면 "Name (Symbol)")
+            option_labels = {}
             
             # 카테고리 필터링 (BuyTransactions 사용)
             if category == "매수종목":
-                filtered_options = []
-                for idx, row in df.iterrows():
-                    # BuyTransactions에 데이터가 있으면 매수종목
-                    buy_txs_str = row.get('BuyTransactions', '[]')
-                    has_buy = False
-                    try:
-                        if pd.notna(buy_txs_str) and str(buy_txs_str).strip():
-                            buy_txs = json.loads(buy_txs_str) if isinstance(buy_txs_str, str) else buy_txs_str
-                            if buy_txs and len(buy_txs) > 0:
-                                has_buy = True
-                    except:
-                        pass
-                    if has_buy:
-                        # 투자전략 필터링 추가
-                        if strategy == "전체":
-                            filtered_options.append(f"{row['Name']} ({row['Symbol']})")
-                        else:
-                            row_category = row.get('Category', '')
-                            if str(row_category).strip() == strategy:
-                                filtered_options.append(f"{row['Name']} ({row['Symbol']})")
+                # BuyTransactions에 데이터가 있으면 매수종목 + 투자전략 필터링
+                buy_mask = derived['has_buy']
+                if strategy != "전체":
+                    buy_mask = buy_mask & (derived['strategy'] == strategy)
+                filtered_options = stock_snapshot.sorted_symbols(buy_mask)
                 if filtered_options:
                     stock_options = filtered_options
             elif category == "관심종목":
                 filtered_options = []
-                interest_stocks_data = []  # 종목 정보 저장 (상승률 계산용)
                 
-                # 주80 체크 여부 확인
-                is_week80 = st.session_state.get("week80_check", False)
+                # 적용할 스크린 식 (주80 체크 + 선택한 스크린)
+                screen_parts = []
+                if st.session_state.get("week80_check", False):
+                    screen_parts.append(SCREEN_PRESETS["주80"])
+                selected_screen = st.session_state.get("screen_preset", "없음")
+                if selected_screen == "직접 입력":
+                    if st.session_state.get("screen_expr", "").strip():
+                        screen_parts.append(st.session_state["screen_expr"].strip())
+                elif selected_screen in SCREEN_PRESETS:
+                    screen_parts.append(SCREEN_PRESETS[selected_screen])
+                screen_expr = " and ".join(f"({part})" for part in screen_parts)
                 
-                for idx, row in df.iterrows():
-                    # BuyTransactions가 비어있고 InterestDate가 있으면 관심종목
-                    buy_txs_str = row.get('BuyTransactions', '[]')
-                    has_buy = False
+                # BuyTransactions가 비어있고 InterestDate가 있으면 관심종목
+                interest_mask = ~derived['has_buy'] & derived['has_interest_date']
+                
+                # 스크린은 후보 종목 전체를 한 번에 계산
+                screen_passed = None
+                if screen_expr:
                     try:
-                        if pd.notna(buy_txs_str) and str(buy_txs_str).strip():
-                            buy_txs = json.loads(buy_txs_str) if isinstance(buy_txs_str, str) else buy_txs_str
-                            if buy_txs and len(buy_txs) > 0:
-                                has_buy = True
-                    except:
-                        pass
-                    if not has_buy and pd.notna(row.get('InterestDate', '')) and str(row.get('InterestDate', '')).strip() != "":
-                        # 주80 필터 적용
-                        if is_week80:
-                            if not check_week80_condition(row['Symbol']):
-                                continue
-                                
-                        stock_display = f"{row['Name']} ({row['Symbol']})"
-                        filtered_options.append(stock_display)
-                        # ChangeRate 컬럼에서 상승률 가져오기
-                        change_rate = row.get('ChangeRate', None)
-                        interest_stocks_data.append({
-                            'display': stock_display,
-                            'symbol': row['Symbol'],
-                            'name': row['Name'],
-                            'change_rate': change_rate  # Google Sheets의 J열 값
-                        })
+                        screen_passed = screen_symbols(df.loc[interest_mask, 'Symbol'].tolist(), screen_expr)
+                    except ScreenExpressionError as e:
+                        st.error(f"❌ {str(e)}")
+                
+                # 스크린 필터 적용 (주80 포함)
+                if screen_passed is not None:
+                    interest_mask = interest_mask & df['Symbol'].isin(screen_passed)
+                
+                filtered_options = stock_snapshot.sorted_symbols(interest_mask)
                 if filtered_options:
                     stock_options = filtered_options
                     
@@ -1492,105 +3646,45 @@ with tab1:
                     sort_by_change = st.session_state.get("sort_by_change", False)
                     
                     if sort_by_change:
-                        # interest_stocks_data가 유효한지 확인
-                        if not interest_stocks_data or len(interest_stocks_data) == 0:
-                            st.warning("관심종목이 없습니다.")
-                            stock_options = sorted(filtered_options) if filtered_options else []
-                        else:
-                            # 세션 상태에 결과가 저장되어 있는지 확인
-                            cache_key = f"interest_stocks_change_{len(interest_stocks_data)}"
-                            
-                            # 안전하게 symbols_key 생성
+                        # 저장소 종가로 상승률 일괄 계산 (없으면 시트의 ChangeRate 사용)
+                        local_changes = get_daily_changes(filtered_options)
+                        # 실시간 시세를 선택했으면 현재가 기준 상승률 우선
+                        if use_intraday_quotes:
+                            for quote_symbol, quote in get_intraday_quotes(filtered_options).items():
+                                if pd.notna(quote.get('change_pct')):
+                                    local_changes[quote_symbol] = float(quote['change_pct'])
+                        if write_change_rates:
                             try:
-                                symbols_list = [s.get('symbol', '') for s in interest_stocks_data if isinstance(s, dict) and 'symbol' in s]
-                                symbols_key = tuple(sorted(symbols_list))
+                                if save_change_rates(local_changes):
+                                    st.success("상승률을 시트에 기록했습니다.")
+                                else:
+                                    st.warning("시트 행 배치가 바뀌어 기록하지 않았습니다. 새로고침 후 다시 시도하세요.")
                             except Exception as e:
-                                symbols_key = tuple()
-                            
-                            # 종목 목록이 변경되었는지 확인
-                            if ('interest_stocks_cache_symbols' in st.session_state and 
-                                st.session_state['interest_stocks_cache_symbols'] == symbols_key and
-                                cache_key in st.session_state):
-                                # 캐시된 결과 사용
-                                stock_with_change = st.session_state[cache_key]
-                            else:
-                                # Google Sheets의 J열(ChangeRate)에서 상승률 가져오기
-                                stock_with_change = []
-                                
-                                for stock_info in interest_stocks_data:
-                                    try:
-                                        # Google Sheets의 ChangeRate 값 사용
-                                        change_rate = stock_info.get('change_rate', None)
-                                        
-                                        # change_rate를 숫자로 변환 시도
-                                        change_pct = None
-                                        if change_rate is not None and pd.notna(change_rate):
-                                            try:
-                                                # 문자열인 경우 숫자로 변환
-                                                if isinstance(change_rate, str):
-                                                    change_rate = change_rate.strip()
-                                                    # % 기호 제거
-                                                    if change_rate.endswith('%'):
-                                                        change_rate = change_rate[:-1]
-                                                    change_pct = float(change_rate)
-                                                else:
-                                                    change_pct = float(change_rate)
-                                            except (ValueError, TypeError):
-                                                change_pct = None
-                                        
-                                        if change_pct is not None:
-                                            stock_with_change.append({
-                                                'display': stock_info.get('display', ''),
-                                                'symbol': stock_info.get('symbol', ''),
-                                                'name': stock_info.get('name', ''),
-                                                'change_pct': change_pct
-                                            })
-                                        else:
-                                            # 상승률이 없는 경우 하단에 배치
-                                            stock_with_change.append({
-                                                'display': stock_info.get('display', ''),
-                                                'symbol': stock_info.get('symbol', ''),
-                                                'name': stock_info.get('name', ''),
-                                                'change_pct': float('-inf')  # 정렬 시 맨 아래로
-                                            })
-                                    except Exception as e:
-                                        # 에러 발생 시 해당 종목만 스킵
-                                        if isinstance(stock_info, dict):
-                                            stock_with_change.append({
-                                                'display': stock_info.get('display', ''),
-                                                'symbol': stock_info.get('symbol', ''),
-                                                'name': stock_info.get('name', ''),
-                                                'change_pct': float('-inf')
-                                            })
-                                
-                                # 결과를 세션 상태에 저장
-                                st.session_state[cache_key] = stock_with_change
-                                st.session_state['interest_stocks_cache_symbols'] = symbols_key
-                            
-                            # 상승률순 정렬 (내림차순)
-                            if stock_with_change:
-                                stock_with_change.sort(key=lambda x: x.get('change_pct', float('-inf')), reverse=True)
-                                
-                                # 상승률 표시 형식으로 변환
-                                stock_options = []
-                                for stock_info in stock_with_change:
-                                    change_pct = stock_info.get('change_pct', float('-inf'))
-                                    if change_pct != float('-inf'):
-                                        change_str = f"{change_pct:+.2f}%"
-                                        # 빨간색으로 표시하기 위해 텍스트에 포함
-                                        stock_options.append(f"{stock_info.get('name', '')} ({stock_info.get('symbol', '')}) {change_str}")
-                                    else:
-                                        stock_options.append(f"{stock_info.get('name', '')} ({stock_info.get('symbol', '')}) N/A")
-                            else:
-                                # stock_with_change가 비어있으면 기본 정렬 사용
-                                stock_options = sorted(filtered_options) if filtered_options else []
+                                st.error(f"❌ 상승률 기록 실패: {str(e)}")
+                        
+                        # 상승률순 정렬 (내림차순, 모든 세션이 같은 결과 공유)
+                        ranking = rank_by_change(
+                            stock_snapshot.revision,
+                            tuple(filtered_options),
+                            tuple(sorted(local_changes.items())),
+                            screen_expr,
+                            stock_snapshot
+                        )
+                        
+                        # 상승률 표시 형식으로 변환 (선택 값은 Symbol 그대로)
+                        stock_options = []
+                        for stock_symbol, change_pct in ranking:
+                            stock_options.append(stock_symbol)
+                            # 빨간색으로 표시하기 위해 텍스트에 포함
+                            change_str = f"{change_pct:+.2f}%" if change_pct is not None else "N/A"
+                            option_labels[stock_symbol] = f"{stock_snapshot.label_of(stock_symbol)} {change_str}"
                     else:
                         # 가나다순 정렬 (기본값)
-                        stock_options = sorted(stock_options)
+                        stock_options = sorted(stock_options, key=stock_snapshot.label_of)
             
             # 가나다순 정렬 (상승률순이 아닐 때만)
             if category != "관심종목" or not st.session_state.get("sort_by_change", False):
-                stock_options = sorted(stock_options)
+                stock_options = sorted(stock_options, key=stock_snapshot.label_of)
             
             # 현재 선택된 종목부터 리스트가 시작되도록 재정렬
             # 카테고리나 정렬 방식이 변경되면 리셋
@@ -1612,7 +3706,12 @@ with tab1:
                         # 리스트 재정렬: 현재 선택 종목부터 시작
                         stock_options = stock_options[current_index:] + stock_options[:current_index]
             
-            selected_stock = st.selectbox("종목 선택", stock_options, key="stock_select")
+            selected_stock = st.selectbox(
+                "종목 선택",
+                stock_options,
+                format_func=lambda option: option_labels.get(option, stock_snapshot.label_of(option)),
+                key="stock_select"
+            )
             
             # 상승률 표시를 위한 CSS 및 JavaScript (selectbox 내부 텍스트 색상 변경)
             if category == "관심종목" and st.session_state.get("sort_by_change", False):
@@ -1720,18 +3819,9 @@ with tab1:
             )
         
         if selected_stock:
-            # 원본 df에서 선택된 종목 찾기
-            # 상승률 텍스트가 포함되어 있을 수 있으므로 제거
-            selected_name_symbol = selected_stock
-            # 상승률 패턴 제거 (+X.XX% 또는 -X.XX% 또는 N/A)
-            selected_name_symbol = re.sub(r'\s+[+-]?\d+\.\d+%', '', selected_name_symbol)  # 상승률 제거
-            selected_name_symbol = re.sub(r'\s+N/A', '', selected_name_symbol)  # N/A 제거
-            
-            selected_row = None
-            for idx, row in df.iterrows():
-                if f"{row['Name']} ({row['Symbol']})" == selected_name_symbol:
-                    selected_row = row
-                    break
+            # 원본 df에서 선택된 종목 찾기 (선택 값이 Symbol이므로 색인으로 바로 조회)
+            selected_pos = stock_snapshot.symbol_index.get(selected_stock)
+            selected_row = df.loc[selected_pos] if selected_pos is not None else None
             
             if selected_row is not None:
                 symbol = selected_row['Symbol']
@@ -1739,22 +3829,9 @@ with tab1:
                 interest_date = selected_row.get('InterestDate', '')
                 note = selected_row.get('Note', '')
                 
-                # BuyTransactions, SellTransactions 읽기 (JSON 파싱)
-                buy_transactions = []
-                sell_transactions = []
-                try:
-                    buy_txs_str = selected_row.get('BuyTransactions', '[]')
-                    if pd.notna(buy_txs_str) and str(buy_txs_str).strip():
-                        buy_transactions = json.loads(buy_txs_str) if isinstance(buy_txs_str, str) else buy_txs_str
-                except:
-                    buy_transactions = []
-                
-                try:
-                    sell_txs_str = selected_row.get('SellTransactions', '[]')
-                    if pd.notna(sell_txs_str) and str(sell_txs_str).strip():
-                        sell_transactions = json.loads(sell_txs_str) if isinstance(sell_txs_str, str) else sell_txs_str
-                except:
-                    sell_transactions = []
+                # BuyTransactions, SellTransactions 읽기 (스냅샷에서 미리 파싱한 값, 읽기 전용)
+                buy_transactions = stock_snapshot.derived.at[selected_pos, 'buy_txs']
+                sell_transactions = stock_snapshot.derived.at[selected_pos, 'sell_txs']
                 
                 # 정보 수정하기 (상단 컨트롤 바 아래 별도 영역)
                 with st.container():
@@ -1856,14 +3933,12 @@ with tab1:
                                     mask = df_stocks['Symbol'] == symbol
                                     if mask.any():
                                         try:
-                                            buy_txs_str = df_stocks.loc[mask, 'BuyTransactions'].values[0]
-                                            buy_txs = json.loads(buy_txs_str) if isinstance(buy_txs_str, str) else buy_txs_str
+                                            buy_txs = copy.deepcopy(buy_transactions)
                                             if i < len(buy_txs):
                                                 buy_txs.pop(i)
                                             df_stocks.loc[mask, 'BuyTransactions'] = json.dumps(buy_txs)
                                             save_stocks(df_stocks)
                                             st.success("삭제되었습니다!")
-                                            time.sleep(0.5)
                                         except:
                                             pass
                                     # 개수 조정
@@ -1910,14 +3985,12 @@ with tab1:
                                     mask = df_stocks['Symbol'] == symbol
                                     if mask.any():
                                         try:
-                                            sell_txs_str = df_stocks.loc[mask, 'SellTransactions'].values[0]
-                                            sell_txs = json.loads(sell_txs_str) if isinstance(sell_txs_str, str) else sell_txs_str
+                                            sell_txs = copy.deepcopy(sell_transactions)
                                             if i < len(sell_txs):
                                                 sell_txs.pop(i)
                                             df_stocks.loc[mask, 'SellTransactions'] = json.dumps(sell_txs)
                                             save_stocks(df_stocks)
                                             st.success("삭제되었습니다!")
-                                            time.sleep(0.5)
                                         except:
                                             pass
                                     # 개수 조정
@@ -1979,352 +4052,35 @@ with tab1:
                 
                 # 주가 데이터 가져오기
                 with st.spinner(f"{name} ({symbol}) 데이터를 불러오는 중..."):
-                    stock_data_full = get_stock_data(symbol)
+                    ohlcv_version_info = get_ohlcv_version(symbol)
+                    stock_data_full = _load_ohlcv_frame(*ohlcv_version_info) if ohlcv_version_info else None
                 
                 if stock_data_full is not None and not stock_data_full.empty:
-                    # 기간선택 박스로 시작일/종료일 자동 설정
+                    ohlcv_key, ohlcv_version = ohlcv_version_info
+                    max_date = stock_data_full.index[-1]
+                    
+                    # 차트 구간 결정 (기간선택 > 시작일/종료일 입력 > 기본 5년)
                     if selected_period and selected_period != "선택안함":
                         period_years = period_options[selected_period]
-                        max_date = stock_data_full.index.max()
-                        min_date = max_date - timedelta(days=int(period_years * 365))
-                        # 기간선택 시 시작일/종료일 자동 계산
-                        calculated_start_date = min_date.date()
-                        calculated_end_date = max_date.date()
+                        range_start = (max_date - timedelta(days=int(period_years * 365))).normalize()
+                        range_end = max_date.normalize()
+                    elif start_date is None and end_date is None:
+                        range_start = max_date - timedelta(days=5 * 365)
+                        range_end = None
                     else:
-                        calculated_start_date = start_date
-                        calculated_end_date = end_date
-                    
-                    # 시작일/종료일에 맞춰 데이터 필터링
-                    stock_data = stock_data_full.copy()
-                    
-                    # 기간선택이 있으면 계산된 날짜 사용, 없으면 사용자 입력 날짜 사용
-                    filter_start_date = calculated_start_date if (selected_period and selected_period != "선택안함") else start_date
-                    filter_end_date = calculated_end_date if (selected_period and selected_period != "선택안함") else end_date
+                        range_start = pd.to_datetime(start_date).normalize() if start_date is not None else None
+                        range_end = pd.to_datetime(end_date).normalize() if end_date is not None else None
                     
-                    if filter_start_date is not None:
-                        start_dt = pd.to_datetime(filter_start_date).normalize()
-                        stock_data = stock_data[stock_data.index >= start_dt].copy()
-                    
-                    if filter_end_date is not None:
-                        end_dt = pd.to_datetime(filter_end_date).normalize()
-                        stock_data = stock_data[stock_data.index <= end_dt].copy()
-                    
-                    # 시작일/종료일이 모두 없으면 기본 5년
-                    if filter_start_date is None and filter_end_date is None:
-                        cutoff_date = stock_data_full.index.max() - timedelta(days=5 * 365)
-                        stock_data = stock_data_full[stock_data_full.index >= cutoff_date].copy()
-                    
-                    # 캔들스틱 차트 생성
-                    fig = go.Figure()
-                    
-                    # 캔들스틱 차트 추가 (한국 스타일 색상)
-                    fig.add_trace(go.Candlestick(
-                        x=stock_data.index,
-                        open=stock_data['Open'],
-                        high=stock_data['High'],
-                        low=stock_data['Low'],
-                        close=stock_data['Close'],
-                        name="주가",
-                        increasing=dict(
-                            line=dict(color='#FF2E2E'),  # 상승: 빨강
-                            fillcolor='#FF2E2E'
-                        ),
-                        decreasing=dict(
-                            line=dict(color='#00C4FF'),  # 하락: 파랑
-                            fillcolor='#00C4FF'
-                        )
-                    ))
-                    
-                    # 20주 이동평균선 및 80주 이동평균선 계산 및 추가
-                    # 일봉 데이터를 주봉으로 변환 (주 단위로 리샘플링)
-                    try:
-                        # 주봉 데이터로 변환 (W-FRI: 금요일 기준 주봉)
-                        weekly_data = stock_data.resample('W-FRI').agg({
-                            'Open': 'first',
-                            'High': 'max',
-                            'Low': 'min',
-                            'Close': 'last'
-                        }).dropna()
-                        
-                        # 20주 이동평균 계산
-                        if len(weekly_data) >= 20:
-                            ma_20 = weekly_data['Close'].rolling(window=20).mean()
-                            # 일봉 인덱스에 맞춰 보간 (interpolation)
-                            ma_20_daily = ma_20.reindex(stock_data.index, method='ffill')
-                            
-                            fig.add_trace(go.Scatter(
-                                x=stock_data.index,
-                                y=ma_20_daily,
-                                mode='lines',
-                                name='20주 이동평균',
-                                line=dict(color='#FF8C00', width=2),  # 주황색 (DarkOrange)
-                                hovertemplate='20주 MA: %{y:.2f}<extra></extra>'
-                            ))
-                        
-                        # 80주 이동평균 계산
-                        if len(weekly_data) >= 80:
-                            ma_80 = weekly_data['Close'].rolling(window=80).mean()
-                            # 일봉 인덱스에 맞춰 보간 (interpolation)
-                            ma_80_daily = ma_80.reindex(stock_data.index, method='ffill')
-                            
-                            fig.add_trace(go.Scatter(
-                                x=stock_data.index,
-                                y=ma_80_daily,
-                                mode='lines',
-                                name='80주 이동평균',
-                                line=dict(color='#32CD32', width=2),  # 초록색 (LimeGreen)
-                                hovertemplate='80주 MA: %{y:.2f}<extra></extra>'
-                            ))
-                    except Exception as e:
-                        # 이동평균 계산 실패 시 무시 (차트는 정상 표시)
-                        pass
-
-                    
-                    # 날짜별 주석 추가
-                    annotations = []
-                    sell_dates = []
-                    sell_prices = []
-                    
-                    # 날짜 문자열을 datetime으로 변환하고 정규화하는 함수
-                    def parse_date_safe(date_str):
-                        if pd.isna(date_str) or date_str == "" or str(date_str).strip() == "":
-                            return None
-                        try:
-                            # 문자열을 datetime으로 변환하고 날짜만 남기기 (시간 정보 제거)
-                            date_dt = pd.to_datetime(date_str).normalize()
-                            return date_dt
-                        except Exception as e:
-                            return None
-                    
-                    # 날짜에 해당하는 마커를 찾는 함수 (주말/휴장일이면 다음 거래일 사용)
-                    def find_trading_date(target_date, data_index):
-                        """
-                        target_date에 해당하는 거래일을 찾습니다.
-                        주말/휴장일이면 다음 거래일(bfill)을 반환합니다.
-                        """
-                        if len(data_index) == 0:
-                            return None
-                        
-                        # 정규화된 날짜로 변환
-                        target_date = pd.to_datetime(target_date).normalize()
-                        
-                        # 정확히 일치하는 날짜가 있는지 확인
-                        if target_date in data_index:
-                            return target_date
-                        
-                        # 정확히 일치하지 않으면 다음 거래일 찾기 (bfill)
-                        # target_date 이후의 데이터만 필터링
-                        future_dates = data_index[data_index >= target_date]
-                        if len(future_dates) > 0:
-                            # 다음 거래일 반환
-                            return future_dates[0]
-                        
-                        # target_date 이전의 가장 가까운 날짜 찾기 (fallback)
-                        past_dates = data_index[data_index <= target_date]
-                        if len(past_dates) > 0:
-                            return past_dates[-1]
-                        
-                        return None
-                    
-                    # 관심일 표시 (네온 노란색 화살표 - 아래 방향)
-                    interest_dt = parse_date_safe(interest_date)
-                    if interest_dt is not None:
-                        try:
-                            if len(stock_data.index) > 0:
-                                # 거래일 찾기
-                                trading_date = find_trading_date(interest_dt, stock_data.index)
-                                if trading_date is not None and trading_date in stock_data.index:
-                                    price = stock_data.loc[trading_date, 'High']
-                                    # 가격 범위 계산 (텍스트 위치)
-                                    price_range = stock_data['High'].max() - stock_data['Low'].min()
-                                    offset = price_range * 0.01  # 가격 범위의 1%만큼 위로
-                                    text_y = price + offset  # 텍스트 위치
-                                    annotations.append(dict(
-                                        x=trading_date,
-                                        y=text_y,  # 텍스트는 위에
-                                        xref="x",
-                                        yref="y",
-                                        text="👀 관심",
-                                        showarrow=True,
-                                        arrowhead=2,
-                                        arrowcolor="#FFD700",  # 네온 노란색
-                                        arrowsize=1.5,
-                                        arrowwidth=2,
-                                        ax=0,
-                                        ay=-70,  # 고정값: 위로 70픽셀
-                                        bgcolor="rgba(0, 0, 0, 0.5)",  # 반투명 검정 배경
-                                        bordercolor="#FFD700",
-                                        borderwidth=2,
-                                        font=dict(size=14, color="#FFD700")  # 텍스트 크기 증가
-                                    ))
-                        except Exception as e:
-                            pass
-                    
-                    # 매수일 표시 (네온 빨간색 화살표 - 위 방향) - BuyTransactions에서 날짜 추출
-                    for idx, tx in enumerate(buy_transactions):
-                        if isinstance(tx, dict):
-                            buy_date_val = tx.get('date', '')
-                        else:
-                            buy_date_val = str(tx) if tx else ''
-                        
-                        if buy_date_val and str(buy_date_val).strip() != "":
-                            buy_dt = parse_date_safe(buy_date_val)
-                            if buy_dt is not None:
-                                try:
-                                    if len(stock_data.index) > 0:
-                                        trading_date = find_trading_date(buy_dt, stock_data.index)
-                                        if trading_date is not None and trading_date in stock_data.index:
-                                            # 가격 정보가 있으면 사용, 없으면 Low 가격 사용
-                                            tx_price = tx.get('price', 0) if isinstance(tx, dict) else 0
-                                            if tx_price and tx_price > 0:
-                                                price = tx_price
-                                            else:
-                                                price = stock_data.loc[trading_date, 'Low']
-                                            
-                                            # 가격 범위 계산 (텍스트 위치)
-                                            price_range = stock_data['High'].max() - stock_data['Low'].min()
-                                            offset = price_range * 0.01  # 가격 범위의 1%만큼 아래로
-                                            text_y = price - offset  # 텍스트 위치
-                                            text_label = "🔴 매수" if idx == 0 else f"🔴 매수{idx+1}"
-                                            annotations.append(dict(
-                                                x=trading_date,
-                                                y=text_y,  # 텍스트는 아래에
-                                                xref="x",
-                                                yref="y",
-                                                text=text_label,
-                                                showarrow=True,
-                                                arrowhead=2,
-                                                arrowcolor="#FF2E2E",  # 네온 빨간색
-                                                arrowsize=1.5,
-                                                arrowwidth=2,
-                                                ax=0,
-                                                ay=70,  # 고정값: 아래로 70픽셀
-                                                bgcolor="rgba(0, 0, 0, 0.5)",  # 반투명 검정 배경
-                                                bordercolor="#FF2E2E",
-                                                borderwidth=2,
-                                                font=dict(size=14, color="#FF2E2E")  # 텍스트 크기 증가
-                                            ))
-                                except Exception as e:
-                                    pass
-                    
-                    # 매도일 표시 (네온 하늘색 화살표 - 아래 방향) - SellTransactions에서 날짜 추출
-                    for idx, tx in enumerate(sell_transactions):
-                        if isinstance(tx, dict):
-                            sell_date_val = tx.get('date', '')
-                        else:
-                            sell_date_val = str(tx) if tx else ''
-                        
-                        if sell_date_val and str(sell_date_val).strip() != "":
-                            sell_dt = parse_date_safe(sell_date_val)
-                            if sell_dt is not None:
-                                try:
-                                    if len(stock_data.index) > 0:
-                                        trading_date = find_trading_date(sell_dt, stock_data.index)
-                                        if trading_date is not None and trading_date in stock_data.index:
-                                            # 가격 정보가 있으면 사용, 없으면 High 가격 사용
-                                            tx_price = tx.get('price', 0) if isinstance(tx, dict) else 0
-                                            if tx_price and tx_price > 0:
-                                                price = tx_price
-                                            else:
-                                                price = stock_data.loc[trading_date, 'High']
-                                            
-                                            # 가격 범위 계산 (텍스트 위치)
-                                            price_range = stock_data['High'].max() - stock_data['Low'].min()
-                                            offset = price_range * 0.01  # 가격 범위의 1%만큼 위로
-                                            text_y = price + offset  # 텍스트 위치
-                                            sell_dates.append(trading_date)
-                                            sell_prices.append(price)
-                                            text_label = "🔵 매도" if idx == 0 else f"🔵 매도{idx+1}"
-                                            annotations.append(dict(
-                                                x=trading_date,
-                                                y=text_y,  # 텍스트는 위에
-                                                xref="x",
-                                                yref="y",
-                                                text=text_label,
-                                                showarrow=True,  # 화살표 추가
-                                                arrowhead=2,
-                                                arrowcolor="#00C4FF",  # 네온 하늘색
-                                                arrowsize=1.5,
-                                                arrowwidth=2,
-                                                ax=0,
-                                                ay=-70,  # 고정값: 위로 70픽셀
-                                                bgcolor="rgba(0, 0, 0, 0.5)",  # 반투명 검정 배경
-                                                bordercolor="#00C4FF",
-                                                borderwidth=2,
-                                                font=dict(size=14, color="#00C4FF"),  # 텍스트 크기 증가
-                                                yshift=10
-                                            ))
-                                except Exception as e:
-                                    pass
-                    
-                    # 매도일 점 마커 추가 (네온 하늘색)
-                    if sell_dates:
-                        fig.add_trace(go.Scatter(
-                            x=sell_dates,
-                            y=sell_prices,
-                            mode='markers',
-                            marker=dict(
-                                symbol='circle',
-                                size=18,  # 크기 증가
-                                color='#00C4FF',  # 네온 하늘색
-                                line=dict(width=2, color='#0088CC')
-                            ),
-                            name="매도",
-                            hovertemplate="매도일: %{x}<br>가격: %{y}<extra></extra>"
-                        ))
-                    
-                    # 레이아웃 설정 (모던 핀테크 스타일)
-                    fig.update_layout(
-                        title=dict(
-                            text=f"{name} ({symbol}) 주가 차트",
-                            font=dict(size=20, color='#ffffff', family='Pretendard'),
-                            x=0.5,
-                            xanchor='center'
-                        ),
-                        xaxis=dict(
-                            title=dict(
-                                text="날짜",
-                                font=dict(color='#e5e7eb', size=14, family='Pretendard')
-                            ),
-                            tickfont=dict(color='#9ca3af', size=12),
-                            gridcolor='rgba(128, 128, 128, 0.1)',  # 연한 회색 그리드
-                            gridwidth=1,
-                            showgrid=True,
-                            zeroline=False,
-                            linecolor='rgba(255, 255, 255, 0.1)',
-                            linewidth=1
-                        ),
-                        yaxis=dict(
-                            title=dict(
-                                text="가격",
-                                font=dict(color='#e5e7eb', size=14, family='Pretendard')
-                            ),
-                            tickfont=dict(color='#9ca3af', size=12),
-                            gridcolor='rgba(128, 128, 128, 0.1)',  # 연한 회색 그리드
-                            gridwidth=1,
-                            showgrid=True,
-                            zeroline=False,
-                            linecolor='rgba(255, 255, 255, 0.1)',
-                            linewidth=1
-                        ),
-                        xaxis_rangeslider_visible=False,
-                        height=600,
-                        annotations=annotations,
-                        hovermode='x unified',
-                        dragmode='zoom',
-                        plot_bgcolor='rgba(0, 0, 0, 0)',
-                        paper_bgcolor='rgba(0, 0, 0, 0)',
-                        font=dict(family='Pretendard', color='#e5e7eb'),
-                        legend=dict(
-                            bgcolor='rgba(0, 0, 0, 0)',
-                            bordercolor='rgba(255, 255, 255, 0.1)',
-                            borderwidth=1,
-                            font=dict(color='#e5e7eb', size=12)
-                        )
+                    # 차트 생성 (입력이 바뀌지 않았으면 캐시된 Figure 사용)
+                    chart_json = build_stock_chart_json(
+                        ohlcv_key, ohlcv_version, symbol, name, range_start, range_end,
+                        str(interest_date) if pd.notna(interest_date) else "",
+                        _transactions_hash(buy_transactions, sell_transactions),
+                        buy_transactions, sell_transactions
                     )
                     
                     # 차트 표시 (확대/축소 버튼 포함, 마우스 휠 줌 활성화)
-                    st.plotly_chart(fig, use_container_width=True, config={
+                    st.plotly_chart(json.loads(chart_json), use_container_width=True, config={
                         'modeBarButtonsToAdd': ['zoomIn2d', 'zoomOut2d', 'resetScale2d', 'pan2d'],
                         'displayModeBar': True,
                         'displaylogo': False,
@@ -2345,75 +4101,151 @@ with tab1:
                         st.info("메모가 없습니다.")
                 else:
                     st.error(f"{symbol} 종목의 데이터를 가져올 수 없습니다. 티커를 확인해주세요.")
+        
+        # 종목 비교 (여러 종목을 하나의 차트로) - 켰을 때만 데이터를 읽고 차트를 만듦
+        # (expander는 접혀 있어도 매 rerun 본문이 실행되므로 토글 사용)
+        st.divider()
+        if st.toggle("📊 종목 비교", key="compare_enabled", help="여러 종목의 수익률/상관관계/상대강도를 비교합니다."):
+            long_mask = stock_snapshot.derived['has_buy'] & (stock_snapshot.derived['strategy'] == "Long")
+            compare_symbols = st.multiselect(
+                "비교 종목",
+                options=stock_snapshot.sorted_symbols(),
+                default=stock_snapshot.sorted_symbols(long_mask)[:COMPARISON_MAX_SYMBOLS],
+                format_func=stock_snapshot.label_of,
+                max_selections=COMPARISON_MAX_SYMBOLS,
+                key="compare_symbols",
+                help="기본값: Long 전략 매수종목"
+            )
+            col_compare1, col_compare2 = st.columns([1, 2])
+            with col_compare1:
+                compare_period = st.selectbox("비교 기간", options=list(period_options.keys()), index=1, key="compare_period")
+            with col_compare2:
+                compare_view = st.radio(
+                    "보기",
+                    options=["수익률 비교", "종목별 차트", "상관관계", "상대강도"],
+                    horizontal=True,
+                    key="compare_view"
+                )
+            
+            if len(compare_symbols) < 2:
+                st.info("비교할 종목을 2개 이상 선택해주세요.")
+            else:
+                compare_start = (pd.Timestamp.today().normalize() - timedelta(days=int(period_options[compare_period] * 365)))
+                with st.spinner("비교 데이터를 불러오는 중..."):
+                    matrices, compare_keys = get_comparison_matrices(compare_symbols, compare_start)
+                
+                if matrices is None:
+                    st.warning("선택한 종목들의 공통 구간 데이터가 없습니다.")
+                else:
+                    # 저장 키 → 표시 이름
+                    key_labels = {}
+                    for compare_symbol in compare_symbols:
+                        if compare_symbol in compare_keys:
+                            key_labels.setdefault(compare_keys[compare_symbol], stock_snapshot.label_of(compare_symbol))
+                    rebased = matrices['rebased']
+                    missing = [stock_snapshot.label_of(compare_symbol) for compare_symbol in compare_symbols if compare_keys.get(compare_symbol) not in rebased.columns]
+                    if missing:
+                        st.caption("데이터가 없어 제외된 종목: " + ", ".join(missing))
+                    
+                    if compare_view == "상관관계":
+                        correlation = matrices['correlation']
+                        labels = [key_labels.get(key, key) for key in correlation.columns]
+                        fig_compare = go.Figure(go.Heatmap(
+                            z=correlation.to_numpy(),
+                            x=labels,
+                            y=labels,
+                            zmin=-1,
+                            zmax=1,
+                            colorscale='RdBu_r',
+                            text=correlation.round(2).to_numpy(),
+                            texttemplate='%{text}',
+                            hovertemplate='%{y} / %{x}: %{z:.2f}<extra></extra>'
+                        ))
+                        fig_compare.update_layout(height=max(400, 40 * len(labels) + 150))
+                    elif compare_view == "종목별 차트":
+                        # 작은 차트 여러 개 (같은 환산 가격 축 사용)
+                        columns = list(rebased.columns)
+                        n_rows = -(-len(columns) // COMPARISON_SUBPLOT_COLUMNS)
+                        fig_compare = make_subplots(
+                            rows=n_rows,
+                            cols=COMPARISON_SUBPLOT_COLUMNS,
+                            shared_xaxes=True,
+                            shared_yaxes=True,
+                            subplot_titles=[key_labels.get(key, key) for key in columns],
+                            vertical_spacing=0.3 / n_rows
+                        )
+                        for i, key in enumerate(columns):
+                            fig_compare.add_trace(go.Scattergl(
+                                x=rebased.index,
+                                y=rebased[key],
+                                mode='lines',
+                                name=key_labels.get(key, key),
+                                showlegend=False,
+                                hovertemplate='%{x|%Y-%m-%d}: %{y:.1f}<extra></extra>'
+                            ), row=i // COMPARISON_SUBPLOT_COLUMNS + 1, col=i % COMPARISON_SUBPLOT_COLUMNS + 1)
+                        fig_compare.update_layout(height=220 * n_rows)
+                    else:
+                        # 수익률 비교 (첫날 = 100) 또는 상대강도 (평균 = 100)를 한 차트에 겹쳐 그림
+                        frame = rebased if compare_view == "수익률 비교" else matrices['relative_strength']
+                        fig_compare = go.Figure()
+                        for key in frame.columns:
+                            fig_compare.add_trace(go.Scattergl(
+                                x=frame.index,
+                                y=frame[key],
+                                mode='lines',
+                                name=key_labels.get(key, key),
+                                hovertemplate=key_labels.get(key, key) + ': %{y:.1f}<extra></extra>'
+                            ))
+                        fig_compare.add_hline(y=100, line=dict(color='rgba(255, 255, 255, 0.3)', dash='dash'))
+                        fig_compare.update_layout(height=600, hovermode='x unified')
+                    
+                    fig_compare.update_layout(
+                        plot_bgcolor='rgba(0, 0, 0, 0)',
+                        paper_bgcolor='rgba(0, 0, 0, 0)',
+                        font=dict(family='Pretendard', color='#e5e7eb'),
+                        legend=dict(bgcolor='rgba(0, 0, 0, 0)', font=dict(color='#e5e7eb', size=12))
+                    )
+                    st.plotly_chart(fig_compare, use_container_width=True)
+                    
+                    # 구간 수익률 요약
+                    summary = pd.DataFrame({
+                        '종목': [key_labels.get(key, key) for key in rebased.columns],
+                        '구간 수익률(%)': (rebased.iloc[-1] - 100).round(2).to_numpy(),
+                        '상대강도': matrices['relative_strength'].iloc[-1].round(1).to_numpy(),
+                    }).sort_values('구간 수익률(%)', ascending=False)
+                    st.dataframe(summary, hide_index=True, use_container_width=True)
 
 # 탭 2: 분할 매수 플래너
 with tab2:
     st.title("💰 주식 분할 매수 플래너")
     
-    # 데이터 로드
-    df_split = load_split_purchase_data()
+    # 데이터 로드 (이번 rerun의 공유 스냅샷)
+    df_split = stock_snapshot.sheet_df.copy()
     
     # 종목 상세 정보를 보여주는 Modal 함수
     @st.dialog("📊 종목 상세 관리")
     def show_stock_detail_modal(stock_id):
         """종목 상세 정보를 Modal Popup으로 표시"""
-        # 최신 데이터 로드 (캐시 클리어하여 최신 데이터 가져오기)
-        load_split_purchase_data.clear()
-        df_split = load_split_purchase_data()
+        # 최신 스냅샷 로드 (저장 시 로컬 저장소가 즉시 갱신됨)
+        snapshot = get_stock_snapshot()
+        df_split = snapshot.sheet_df.copy()
         
-        # stock_id로 종목 찾기
-        matching_rows = df_split[df_split['Symbol'] == stock_id]
+        # stock_id로 종목 찾기 (스냅샷의 Symbol 색인 사용)
+        stock_idx = snapshot.symbol_index.get(stock_id)
         
-        if matching_rows.empty:
+        if stock_idx is None:
             st.error("종목을 찾을 수 없습니다.")
             return
         
-        stock_idx = matching_rows.index[0]
         stock_row = df_split.loc[stock_idx]
         
         stock_name = stock_row.get('Name', '')
         market_cap = stock_row.get('MarketCap', 0)
         installments = stock_row.get('Installments', 3)
         
-        # BuyTransactions 파싱 (더 안전한 방식)
-        buy_txs_raw = stock_row.get('BuyTransactions', '[]')
-        buy_txs = []
-        if pd.notna(buy_txs_raw) and str(buy_txs_raw).strip():
-            if isinstance(buy_txs_raw, list):
-                buy_txs = buy_txs_raw
-            elif isinstance(buy_txs_raw, str):
-                try:
-                    buy_txs_str = str(buy_txs_raw).strip()
-                    if buy_txs_str and buy_txs_str != '[]' and buy_txs_str != '':
-                        buy_txs = json.loads(buy_txs_str)
-                    else:
-                        buy_txs = []
-                except (json.JSONDecodeError, ValueError, TypeError) as e:
-                    buy_txs = []
-            else:
-                buy_txs = []
-        else:
-            buy_txs = []
-        
-        # SellTransactions 파싱 (더 안전한 방식)
-        sell_txs_raw = stock_row.get('SellTransactions', '[]')
-        sell_txs = []
-        if pd.notna(sell_txs_raw) and str(sell_txs_raw).strip():
-            if isinstance(sell_txs_raw, list):
-                sell_txs = sell_txs_raw
-            elif isinstance(sell_txs_raw, str):
-                try:
-                    sell_txs_str = str(sell_txs_raw).strip()
-                    if sell_txs_str and sell_txs_str != '[]' and sell_txs_str != '':
-                        sell_txs = json.loads(sell_txs_str)
-                    else:
-                        sell_txs = []
-                except (json.JSONDecodeError, ValueError, TypeError) as e:
-                    sell_txs = []
-            else:
-                sell_txs = []
-        else:
-            sell_txs = []
+        # 거래 내역 (스냅샷에서 미리 파싱한 값을 복사해서 사용 - 아래에서 수정됨)
+        buy_txs = copy.deepcopy(snapshot.derived.at[stock_idx, 'buy_txs'])
+        sell_txs = copy.deepcopy(snapshot.derived.at[stock_idx, 'sell_txs'])
         
         # MarketCap을 안전하게 숫자로 변환
         try:
@@ -2551,6 +4383,23 @@ with tab2:
         col_prog1.write(f"**매수 진행률: {progress:.2f}%**")
         col_prog2.write(f"**총 실현손익: {total_realized_profit:,.0f}원**")
         
+        # 현재가 및 평가손익 (실시간 시세, INTRADAY_QUOTE_TTL 캐시)
+        quote = get_intraday_quotes([stock_id]).get(stock_id)
+        if quote is not None and pd.notna(quote.get('price')):
+            current_price = float(quote['price'])
+            col_q1, col_q2, col_q3 = st.columns(3)
+            change_pct = quote.get('change_pct')
+            col_q1.metric(
+                "현재가",
+                f"{current_price:,.0f}원",
+                f"{change_pct:+.2f}%" if pd.notna(change_pct) else None,
+                delta_color="inverse"  # 한국 스타일: 상승 빨강, 하락 파랑
+            )
+            if current_qty > 0 and avg_price > 0:
+                unrealized_profit = (current_price - avg_price) * current_qty
+                col_q2.metric("평가손익", f"{unrealized_profit:,.0f}원")
+                col_q3.metric("평가수익률", f"{(current_price - avg_price) / avg_price * 100:+.2f}%")
+        
         st.divider()
         
         # 매수 계획 및 기록
@@ -2809,30 +4658,14 @@ with tab2:
     
     # Installments가 있는 종목만 필터링 (분할 매수 플래너용)
     if not df_split.empty:
-        # Installments가 비어있지 않은 종목만 (숫자 또는 문자열 모두 처리)
-        def has_installments(val):
-            if pd.isna(val):
-                return False
-            if val == '' or val == 0:
-                return False
-            try:
-                # 숫자로 변환 가능한지 확인
-                float_val = float(val)
-                return float_val > 0
-            except (ValueError, TypeError):
-                return False
-        
-        df_split = df_split[df_split['Installments'].apply(has_installments)].copy()
+        # Installments가 0보다 큰 숫자인 종목만 (스냅샷에서 미리 계산한 마스크 사용)
+        df_split = df_split[stock_snapshot.derived['has_installments']].copy()
         
-        # JSON 파싱 (필터링 후)
+        # 거래 내역 (필터링 후, 스냅샷에서 미리 파싱한 값 사용)
         if 'BuyTransactions' in df_split.columns:
-            df_split['BuyTransactions'] = df_split['BuyTransactions'].apply(
-                lambda x: json.loads(x) if isinstance(x, str) and x and x != '[]' else []
-            )
+            df_split['BuyTransactions'] = stock_snapshot.derived.loc[df_split.index, 'buy_txs']
         if 'SellTransactions' in df_split.columns:
-            df_split['SellTransactions'] = df_split['SellTransactions'].apply(
-                lambda x: json.loads(x) if isinstance(x, str) and x and x != '[]' else []
-            )
+            df_split['SellTransactions'] = stock_snapshot.derived.loc[df_split.index, 'sell_txs']
     
     # ==========================================
     # 1. 포트폴리오 요약 및 우측 상단 버튼
@@ -2884,7 +4717,7 @@ with tab2:
                     if name and market_cap > 0:
                         # Symbol 중복 체크
                         symbol_normalized = symbol.strip().upper() if symbol else ""
-                        all_stocks = load_stocks()
+                        all_stocks = stock_snapshot.stocks_df
                         
                         if symbol_normalized:
                             existing_symbols = all_stocks['Symbol'].astype(str).str.strip().str.upper()
@@ -2913,43 +4746,22 @@ with tab2:
                         st.error("종목명과 시가총액을 입력해주세요.")
         
         with st.expander("📋 관심종목에서 가져오기", expanded=False):
-            all_stocks = load_stocks()
+            all_stocks = stock_snapshot.stocks_df
             
-            # 관심종목 필터링 (Installments가 비어있고 BuyTransactions가 비어있는 종목)
-            interest_stocks = []
-            for idx, row in all_stocks.iterrows():
-                installments = row.get('Installments', '')
-                buy_txs_str = row.get('BuyTransactions', '[]')
-                
-                # Installments가 비어있고 BuyTransactions가 비어있는 종목
-                has_installments = pd.notna(installments) and str(installments).strip() != "" and installments != 0
-                has_buy = False
-                try:
-                    if pd.notna(buy_txs_str) and str(buy_txs_str).strip() and buy_txs_str != '[]':
-                        buy_txs = json.loads(buy_txs_str) if isinstance(buy_txs_str, str) else buy_txs_str
-                        has_buy = len(buy_txs) > 0 if isinstance(buy_txs, list) else False
-                except:
-                    pass
-                
-                if not has_installments and not has_buy:
-                    interest_stocks.append({
-                        'Symbol': row.get('Symbol', ''),
-                        'Name': row.get('Name', ''),
-                        'InterestDate': row.get('InterestDate', '')
-                    })
+            # 관심종목 필터링 (Installments가 비어있고 BuyTransactions가 비어있는 종목 - 스냅샷의 파생 컬럼 사용)
+            import_mask = ~stock_snapshot.derived['has_installments'] & ~stock_snapshot.derived['has_buy']
+            # 가나다 순으로 정렬 (선택 값은 Symbol)
+            interest_options = stock_snapshot.sorted_symbols(import_mask)
             
-            if interest_stocks:
-                # 가나다 순으로 정렬 (종목명 기준)
-                interest_stocks_sorted = sorted(interest_stocks, key=lambda x: x['Name'])
-                interest_options = [f"{s['Name']} ({s['Symbol']})" for s in interest_stocks_sorted]
-                selected_interest = st.selectbox("관심종목 선택", interest_options, key="select_interest_stock")
+            if interest_options:
+                selected_interest = st.selectbox("관심종목 선택", interest_options, format_func=stock_snapshot.label_of, key="select_interest_stock")
                 
                 with st.form("import_interest_stock_form"):
                     # 선택된 종목 정보 표시
-                    selected_idx = interest_options.index(selected_interest) if selected_interest in interest_options else -1
+                    selected_idx = stock_snapshot.symbol_index.get(selected_interest, -1)
                     if selected_idx >= 0:
-                        selected_stock = interest_stocks_sorted[selected_idx]
-                        st.info(f"선택된 종목: {selected_stock['Name']} ({selected_stock['Symbol']})")
+                        selected_stock = all_stocks.loc[selected_idx]
+                        st.info(f"선택된 종목: {stock_snapshot.label_of(selected_interest)}")
                     
                     market_cap = st.number_input("시가총액 (억원)", min_value=0, step=1000, placeholder="예: 5000000", key="import_market_cap")
                     installments = st.number_input("분할 횟수", min_value=1, value=3, key="import_installments")
@@ -2957,7 +4769,6 @@ with tab2:
                     
                     if st.form_submit_button("분할 매수 플래너에 추가"):
                         if selected_idx >= 0 and market_cap > 0:
-                            selected_stock = interest_stocks_sorted[selected_idx]
                             # 기존 종목 업데이트
                             all_stocks = load_stocks()
                             mask = all_stocks['Symbol'] == selected_stock['Symbol']
@@ -2976,53 +4787,33 @@ with tab2:
     if df_split.empty:
         st.info("추가된 종목이 없습니다.")
     else:
-        # 포트폴리오 계산
-        portfolio_data = []
-        total_invested = 0
-        total_budget = 0
-        
-        for _, stock in df_split.iterrows():
-            buy_txs = stock.get('BuyTransactions', []) if isinstance(stock.get('BuyTransactions'), list) else []
-            sell_txs = stock.get('SellTransactions', []) if isinstance(stock.get('SellTransactions'), list) else []
-            
-            # 매수 총액 계산
-            buy_cost = 0
-            buy_qty = 0
-            for tx in buy_txs:
-                if tx and isinstance(tx, dict):
-                    buy_cost += tx.get('price', 0) * tx.get('quantity', 0)
-                    buy_qty += tx.get('quantity', 0)
-            
-            # 매도 수량 계산
-            sell_qty = sum(tx.get('quantity', 0) for tx in sell_txs if isinstance(tx, dict))
-            
-            avg_price = buy_cost / buy_qty if buy_qty > 0 else 0
-            current_qty = buy_qty - sell_qty
-            current_invested = current_qty * avg_price
-            
-            # MarketCap을 안전하게 숫자로 변환
-            market_cap_value = stock.get('MarketCap', 0)
-            try:
-                if pd.notna(market_cap_value) and str(market_cap_value).strip() != "":
-                    market_cap_value = float(market_cap_value)
-                else:
-                    market_cap_value = 0
-            except (ValueError, TypeError):
-                market_cap_value = 0
-            
-            max_investment = market_cap_value / 10000
-            progress = (current_invested / max_investment * 100) if max_investment > 0 else 0
-            
-            portfolio_data.append({
-                'id': stock.get('Symbol', f'stock_{idx}'),  # Symbol을 ID로 사용
-                'name': stock.get('Name', ''),
-                'totalInvested': current_invested,
-                'progress': progress,
-                'maxInvestment': max_investment
-            })
-            
-            total_invested += current_invested
-            total_budget += max_investment
+        # 포트폴리오 계산 (스냅샷에서 미리 계산한 매수 수량/금액, 보유 수량 사용)
+        split_derived = stock_snapshot.derived.loc[df_split.index]
+        avg_price = (split_derived['buy_cost'] / split_derived['buy_qty']).where(split_derived['buy_qty'] > 0, 0.0)
+        current_invested = split_derived['holding_qty'] * avg_price
+        
+        # MarketCap을 안전하게 숫자로 변환
+        if 'MarketCap' in df_split.columns:
+            market_cap_values = pd.to_numeric(df_split['MarketCap'].astype(str).str.strip(), errors='coerce').fillna(0)
+        else:
+            market_cap_values = pd.Series(0.0, index=df_split.index)
+        max_investment = market_cap_values / 10000
+        progress = (current_invested / max_investment * 100).where(max_investment > 0, 0.0)
+        
+        portfolio_data = [
+            {
+                'id': symbol_value,  # Symbol을 ID로 사용
+                'name': name_value,
+                'totalInvested': float(invested),
+                'progress': float(pct),
+                'maxInvestment': float(budget)
+            }
+            for symbol_value, name_value, invested, pct, budget in zip(
+                df_split['Symbol'], df_split['Name'], current_invested, progress, max_investment
+            )
+        ]
+        total_invested = float(current_invested.sum())
+        total_budget = float(max_investment.sum())
         
         overall_progress = (total_invested / total_budget * 100) if total_budget > 0 else 0
         
@@ -3589,4 +5380,94 @@ with tab2:
     # ==========================================
     # 2. 종목별 카드 표시
     # ==========================================
-    # 기존 Expander 루프는 제거됨 - 클릭 시에만 dialog 호출
\ No newline at end of file
+    # 기존 Expander 루프는 제거됨 - 클릭 시에만 dialog 호출
+
+# 탭 3: 시장 스크리너 (KRX 전 종목)
+with tab3:
+    st.title("🌐 시장 스크리너")
+    
+    if not FDR_AVAILABLE:
+        st.warning("FinanceDataReader가 설치되어 있지 않아 시장 스크리너를 사용할 수 없습니다.")
+    else:
+        universe_job = get_universe_job()
+        universe_version = get_universe_version()
+        
+        # 저장소 상태 및 갱신
+        col_status, col_refresh = st.columns([3, 1])
+        with col_status:
+            job_status = dict(universe_job.status)
+            if universe_job.is_running():
+                total = max(job_status['total'], 1)
+                st.progress(min(1.0, job_status['done'] / total), text=f"{job_status['message']} ({job_status['done']:,}/{job_status['total']:,}, 실패 {job_status['failed']:,})")
+            elif universe_version is None:
+                st.info("저장된 시장 데이터가 없습니다. '전체 시장 데이터 갱신'을 눌러 주세요. (처음 한 번은 수 분 걸립니다)")
+            else:
+                st.caption(f"마지막 갱신: {datetime.fromtimestamp(universe_version).strftime('%Y-%m-%d %H:%M')}")
+                if job_status['state'] == 'error':
+                    st.error(f"❌ 갱신 실패: {job_status['message']}")
+        with col_refresh:
+            if st.button("🔄 전체 시장 데이터 갱신", key="universe_refresh", disabled=universe_job.is_running()):
+                universe_job.start()
+                st.rerun()
+        
+        # 스크린 선택
+        col_screen, col_market = st.columns([2, 1])
+        with col_screen:
+            universe_preset = st.selectbox(
+                "스크린",
+                options=list(SCREEN_PRESETS) + ["직접 입력"],
+                key="universe_screen_preset"
+            )
+            if universe_preset == "직접 입력":
+                universe_expr = st.text_input(
+                    "스크린 식",
+                    key="universe_screen_expr",
+                    placeholder="예: ma_div(80, 10, 3) and volume_spike(2, 20)",
+                    help="사용 가능한 규칙: " + ", ".join(SCREEN_RULES) + " (and / or / not, 괄호 사용 가능)"
+                ).strip()
+            else:
+                universe_expr = SCREEN_PRESETS[universe_preset]
+        with col_market:
+            universe_markets = st.multiselect("시장", options=UNIVERSE_MARKETS, default=UNIVERSE_MARKETS, key="universe_markets")
+        
+        if universe_version is not None and universe_expr:
+            try:
+                hits = scan_universe(universe_expr, universe_version, tuple(universe_markets))
+            except ScreenExpressionError as e:
+                st.error(f"❌ {str(e)}")
+                hits = None
+            
+            if hits is not None:
+                st.write(f"**{len(hits):,}개 종목**")
+                st.dataframe(
+                    hits.rename(columns={'Code': '코드', 'Name': '종목명', 'Market': '시장', 'Close': '종가', 'ChangePct': '상승률(%)'}),
+                    use_container_width=True,
+                    hide_index=True,
+                    column_config={
+                        '종가': st.column_config.NumberColumn(format="%,.0f"),
+                        '상승률(%)': st.column_config.NumberColumn(format="%+.2f"),
+                    }
+                )
+                
+                # 관심종목으로 추가
+                if not hits.empty:
+                    hit_labels = dict(zip(hits['Code'], hits['Name'].fillna("").astype(str) + " (" + hits['Code'] + ")"))
+                    selected_hits = st.multiselect(
+                        "관심종목에 추가할 종목",
+                        options=list(hit_labels),
+                        format_func=hit_labels.get,
+                        key="universe_selected_hits"
+                    )
+                    if st.button("➕ 관심종목에 추가", key="universe_add_hits", disabled=not selected_hits):
+                        names = dict(zip(hits['Code'], hits['Name']))
+                        try:
+                            added, duplicates = add_interest_stocks([
+                                (code, names.get(code) or code, datetime.now().date(), f"시장 스크리너: {universe_expr}")
+                                for code in selected_hits
+                            ])
+                            if added:
+                                st.success(f"{len(added)}개 종목이 관심종목에 추가되었습니다!")
+                            if duplicates:
+                                st.info(f"이미 등록된 종목 {len(duplicates)}개는 건너뛰었습니다: {', '.join(duplicates)}")
+                        except Exception as e:
+                            st.error(f"❌ 추가 실패: {str(e)}")
@@ -0,0 +1,60 @@
+import ast
+import inspect
+import os
+
+import pytest
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+
+# app.py는 실행 시 Streamlit 화면을 그리므로, 스크린 식 컴파일에 필요한 정의만 꺼내서 실행
+def _load_screen_compiler():
+    with open(APP_PATH, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    wanted = []
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef) and node.name == "ScreenExpressionError":
+            wanted.append(node)
+        elif isinstance(node, ast.FunctionDef) and (node.name.startswith("_rule_") or node.name == "compile_screen"):
+            node.decorator_list = []
+            wanted.append(node)
+        elif isinstance(node, ast.Assign) and any(getattr(t, "id", None) == "SCREEN_RULES" for t in node.targets):
+            wanted.append(node)
+    namespace = {"ast": ast, "inspect": inspect}
+    exec(compile(ast.Module(body=wanted, type_ignores=[]), APP_PATH, "exec"), namespace)
+    return namespace
+
+
+SCREEN = _load_screen_compiler()
+
+
+@pytest.mark.parametrize("expr", [
+    "ma_div(80, 10, 3)",
+    "ma_div(window=20, pct=5)",
+    "gap_up(3)",
+    "breakout_high",
+])
+def test_compile_screen_accepts_valid_arguments(expr):
+    assert callable(SCREEN["compile_screen"](expr))
+
+
+@pytest.mark.parametrize("expr", [
+    "ma_div(1, 2, 3, 4)",
+    "gap_up(1, 2)",
+    "volume_spike(1, 2, 3)",
+    "ma_div(80, window=20)",
+])
+def test_compile_screen_rejects_bad_arity(expr):
+    with pytest.raises(SCREEN["ScreenExpressionError"]):
+        SCREEN["compile_screen"](expr)
+
+
+@pytest.mark.parametrize("expr", [
+    "ma_div(foo=1)",
+    "gap_up(panel=1)",
+    "ma_div(**x)",
+    "ma_div(*x)",
+])
+def test_compile_screen_rejects_bad_keywords(expr):
+    with pytest.raises(SCREEN["ScreenExpressionError"]):
+        SCREEN["compile_screen"](expr)